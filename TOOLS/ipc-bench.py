@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for the JSON IPC (input/ipc-unix.c, json_execute_command()).
+
+This starts a local mpv with --idle --no-video --ao=null and an IPC socket,
+then runs commands on it for a while and reports the throughput and the
+round-trip latency percentiles:
+
+    $ ipc-bench.py --connections 4 --depth 16 --duration 10 \\
+        --mix '8:["get_property", "volume"]' --mix '1:["set_property", "pause", true]'
+
+--connections is the number of client connections, --depth the number of
+requests each keeps in flight (pipelining). Each --mix entry is a command as a
+JSON array, prefixed by its relative weight; commands are picked at random
+according to the weights. Requests that complete during --warmup are not
+counted.
+
+Use --socket to benchmark an already running mpv instead. As with umpv, the
+mpv binary and extra options can be set with the MPV environment variable.
+
+The latencies include the overhead of the Python client, which runs in a single
+process; with many connections it can become the bottleneck, so compare
+numbers taken with the same settings.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import mpv_ipc
+
+def parse_mix(arg):
+    try:
+        weight, command = arg.split(":", 1)
+        weight = float(weight)
+        command = json.loads(command)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected WEIGHT:[JSON command]")
+    if not isinstance(command, list) or not command:
+        raise argparse.ArgumentTypeError("the command must be a JSON array")
+    return weight, command
+
+def percentile(values, q):
+    """
+    q-th percentile (nearest rank) of the sorted list values: the smallest
+    value that at least q% of the values are less than or equal to.
+    """
+    # round away float error, e.g. 99.9 / 100 * 1000 is 999.0000000000001
+    rank = math.ceil(round(q * len(values) / 100, 6))
+    return values[max(rank - 1, 0)]
+
+async def start_mpv(path, timeout=10):
+    """
+    Start mpv with its IPC socket at path, and wait until it accepts
+    connections. Returns the process.
+    """
+    opts = (os.getenv("MPV") or "mpv").split()
+    opts.extend(["--no-config", "--idle", "--no-video", "--ao=null",
+                 "--no-terminal", "--input-ipc-server=" + path])
+    proc = subprocess.Popen(opts)
+    deadline = time.monotonic() + timeout
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError("mpv exited with status %d" % proc.returncode)
+        try:
+            client = await mpv_ipc.connect(path)
+        except OSError:
+            if time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError("mpv didn't create the IPC socket")
+            await asyncio.sleep(0.05)
+        else:
+            await client.close()
+            return proc
+
+async def worker(client, commands, weights, rnd, start, end, stats):
+    """
+    Run commands on client until end. Requests completing after start are
+    added to stats.
+    """
+    latencies = stats["latencies"]
+    while True:
+        command = rnd.choices(commands, weights)[0]
+        t = time.perf_counter()
+        if t >= end:
+            break
+        try:
+            await client.request(command)
+        except mpv_ipc.MPVError:
+            error = True
+        else:
+            error = False
+        done = time.perf_counter()
+        if done >= start:
+            latencies.append(done - t)
+            if error:
+                stats["errors"] += 1
+
+async def run(path, args):
+    mix = args.mix or [(1, ["get_property", "volume"])]
+    commands = [command for weight, command in mix]
+    weights = [weight for weight, command in mix]
+    rnd = random.Random(args.seed)
+
+    clients = [await mpv_ipc.connect(path, max_pending=args.depth)
+               for n in range(args.connections)]
+    stats = {"latencies": [], "errors": 0}
+    start = time.perf_counter() + args.warmup
+    end = start + args.duration
+    try:
+        await asyncio.gather(*[worker(client, commands, weights, rnd,
+                                      start, end, stats)
+                               for client in clients
+                               for n in range(args.depth)])
+    finally:
+        for client in clients:
+            await client.close()
+
+    latencies = sorted(stats["latencies"])
+    result = {
+        "connections": args.connections,
+        "depth": args.depth,
+        "duration": args.duration,
+        "requests": len(latencies),
+        "errors": stats["errors"],
+        "throughput": len(latencies) / args.duration,
+        "latency_ms": {},
+    }
+    if latencies:
+        for name, q in [("p50", 50), ("p90", 90), ("p99", 99), ("p99.9", 99.9)]:
+            result["latency_ms"][name] = percentile(latencies, q) * 1e3
+        result["latency_ms"]["max"] = latencies[-1] * 1e3
+    return result
+
+def print_result(result):
+    print("connections %d, depth %d, %.1f s" %
+          (result["connections"], result["depth"], result["duration"]))
+    print("requests:   %d (%d errors)" % (result["requests"], result["errors"]))
+    print("throughput: %.0f requests/s" % result["throughput"])
+    print("latency:    " + ", ".join("%s %.3f ms" % (name, val) for name, val
+                                     in result["latency_ms"].items()))
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Measure JSON IPC throughput and latency.")
+    parser.add_argument("--socket",
+                        help="benchmark the mpv instance listening on this "
+                             "socket instead of starting one")
+    parser.add_argument("-c", "--connections", type=int, default=1,
+                        help="number of connections (default: %(default)s)")
+    parser.add_argument("-d", "--depth", type=int, default=1,
+                        help="requests in flight per connection "
+                             "(default: %(default)s)")
+    parser.add_argument("-t", "--duration", type=float, default=5,
+                        help="seconds to measure (default: %(default)s)")
+    parser.add_argument("--warmup", type=float, default=1,
+                        help="seconds to run before measuring "
+                             "(default: %(default)s)")
+    parser.add_argument("--mix", type=parse_mix, action="append",
+                        metavar="WEIGHT:COMMAND",
+                        help="command to run, as a JSON array, with its "
+                             "relative weight (can be given multiple times; "
+                             "default: 1:[\"get_property\", \"volume\"])")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for picking commands")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+
+    proc = None
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = args.socket
+        if not path:
+            path = os.path.join(tmpdir, "mpv.sock")
+            proc = await start_mpv(path)
+        try:
+            result = await run(path, args)
+        finally:
+            if proc:
+                proc.terminate()
+                proc.wait()
+
+    if args.json:
+        json.dump(result, sys.stdout, indent=4)
+        print()
+    else:
+        print_result(result)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+"""
+Multiplexer for controlling many mpv instances over IPC.
+
+This keeps a persistent connection to the IPC socket (--input-ipc-server) of
+every given mpv instance, and reconnects when an instance is restarted. It
+listens on a socket of its own, which accepts the same JSON messages as mpv,
+but runs each command on all connected instances in parallel. The reply maps
+each instance's socket path to its result, and the time the command took:
+
+    $ ipc-mux.py --listen /tmp/mux.sock '/run/signage/*.sock' &
+    $ echo '{ "command": ["get_property", "pause"], "request_id": 1 }' \\
+        | socat - /tmp/mux.sock
+    { "request_id": 1, "error": "success", "data": {
+        "/run/signage/a.sock": { "error": "success", "data": false, "latency": 0.21 },
+        "/run/signage/b.sock": { "error": "not connected", "latency": 0.0 } } }
+
+(shown formatted; the actual reply is a single line). Latencies are in
+milliseconds. The optional "targets" field of a message restricts it to the
+given socket paths. The "mux_list" command returns whether each instance is
+connected, without sending anything to mpv.
+
+The arguments can be glob patterns, which are expanded again periodically, so
+instances started later are picked up. Instances whose socket file went away
+are dropped.
+"""
+
+import argparse
+import asyncio
+import errno
+import glob
+import json
+import logging
+import os
+import signal
+
+import mpv_ipc
+
+log = logging.getLogger("ipc-mux")
+
+class Instance:
+    """
+    A persistent connection to a single mpv instance.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.client = None
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    @property
+    def connected(self):
+        return self.client is not None and not self.client.closed
+
+    async def run(self):
+        delay = 0.1
+        while True:
+            try:
+                self.client = await mpv_ipc.connect(self.path)
+            except OSError as e:
+                # the same cases umpv checks for: ECONNREFUSED is an abandoned
+                # socket, ENOENT means mpv hasn't created it (yet)
+                if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+                    log.warning("%s: %s", self.path, e)
+            else:
+                log.info("%s: connected", self.path)
+                delay = 0.1
+                await self.client.wait_closed()
+                log.info("%s: disconnected", self.path)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5)
+
+    async def request(self, command, timeout):
+        """
+        Run command, and return a dict with the error, data (if successful)
+        and latency in ms.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        res = {}
+        if not self.connected:
+            res["error"] = "not connected"
+        else:
+            try:
+                data = await asyncio.wait_for(self.client.request(command),
+                                              timeout)
+            except mpv_ipc.MPVError as e:
+                res["error"] = e.error
+            except mpv_ipc.ConnectionClosed:
+                res["error"] = "not connected"
+            except asyncio.TimeoutError:
+                res["error"] = "timeout"
+            except Exception as e:
+                # don't fail the replies of the other instances
+                log.warning("%s: %r", self.path, e)
+                res["error"] = str(e) or type(e).__name__
+            else:
+                res["error"] = "success"
+                res["data"] = data
+        res["latency"] = round((loop.time() - start) * 1000, 3)
+        return res
+
+    async def close(self):
+        self.task.cancel()
+        if self.client:
+            await self.client.close()
+
+class Mux:
+    """
+    The set of instances matching the patterns, and the server side of the
+    multiplexer socket.
+    """
+    def __init__(self, patterns, timeout):
+        self.patterns = patterns
+        self.timeout = timeout
+        self.instances = {}
+        self.clients = set()
+
+    def rescan(self):
+        paths = set()
+        for pattern in self.patterns:
+            if glob.has_magic(pattern):
+                paths.update(glob.glob(pattern))
+            else:
+                # explicitly given; keep trying even if it doesn't exist
+                paths.add(pattern)
+        for path in paths - set(self.instances):
+            self.instances[path] = Instance(path)
+        for path in set(self.instances) - paths:
+            instance = self.instances.pop(path)
+            asyncio.get_running_loop().create_task(instance.close())
+
+    async def rescan_loop(self, interval):
+        while True:
+            self.rescan()
+            await asyncio.sleep(interval)
+
+    async def handle_message(self, msg):
+        command = msg.get("command")
+        targets = msg.get("targets")
+        instances = [i for path, i in sorted(self.instances.items())
+                     if targets is None or path in targets]
+        if command == ["mux_list"]:
+            return {"error": "success",
+                    "data": {i.path: i.connected for i in instances}}
+        if not isinstance(command, list) or not command:
+            return {"error": "invalid parameter"}
+        results = await asyncio.gather(*[i.request(command, self.timeout)
+                                         for i in instances])
+        return {"error": "success",
+                "data": {i.path: r for i, r in zip(instances, results)}}
+
+    async def close(self):
+        """
+        Disconnect all clients and instances.
+        """
+        for client in self.clients:
+            client.cancel()
+        if self.clients:
+            await asyncio.wait(self.clients)
+        await asyncio.gather(*[i.close() for i in self.instances.values()])
+
+    async def serve_client(self, reader, writer):
+        async def reply(line):
+            try:
+                msg = json.loads(line)
+                if not isinstance(msg, dict):
+                    raise ValueError("not a JSON object")
+            except ValueError:
+                res = {"error": "invalid parameter"}
+            else:
+                res = await self.handle_message(msg)
+                if "request_id" in msg:
+                    res["request_id"] = msg["request_id"]
+            data = json.dumps(res, ensure_ascii=False) + "\n"
+            writer.write(data.encode("utf-8", "surrogateescape"))
+
+        # messages are handled concurrently; replies are written as they
+        # complete, like mpv does for async commands
+        tasks = set()
+        self.clients.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.get_running_loop().create_task(reply(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                await writer.drain()
+            if tasks:
+                await asyncio.wait(tasks)
+        except OSError:
+            pass
+        except asyncio.CancelledError:
+            # cancelled by close(); end normally, because asyncio (before
+            # Python 3.12) logs the connection handler's CancelledError as an
+            # unhandled exception
+            pass
+        finally:
+            self.clients.discard(asyncio.current_task())
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.wait(tasks)
+            writer.close()
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Run IPC commands on many mpv instances at once.")
+    parser.add_argument("sockets", nargs="+",
+                        help="IPC socket paths or glob patterns of the mpv "
+                             "instances")
+    parser.add_argument("--listen", required=True,
+                        help="path of the socket to listen on")
+    parser.add_argument("--timeout", type=float, default=5,
+                        help="seconds to wait for each instance's reply "
+                             "(default: %(default)s)")
+    parser.add_argument("--rescan", type=float, default=2,
+                        help="interval in seconds for expanding the patterns "
+                             "again (default: %(default)s)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="log connects and disconnects")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(name)s: %(message)s",
+                        level=logging.INFO if args.verbose else logging.WARNING)
+
+    mux = Mux(args.sockets, args.timeout)
+    mux.rescan()
+    if os.path.exists(args.listen):
+        os.unlink(args.listen)
+    server = await asyncio.start_unix_server(mux.serve_client, args.listen)
+    # exit cleanly (removing the socket) when stopped as a service
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                  asyncio.current_task().cancel)
+    try:
+        await mux.rescan_loop(args.rescan)
+    finally:
+        server.close()
+        await mux.close()
+        os.unlink(args.listen)
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -229,12 +229,22 @@ elements_matroska = (
 )
 
 
+import os
+import ast
 import sys
-from math import ldexp
+import json
+import mmap
+import zlib
+import struct
+from io import StringIO
+from string import Template
+from array import array
+from bisect import bisect_right
 from binascii import hexlify
+from concurrent.futures import ProcessPoolExecutor
 
 def byte2num(s):
-    return int(hexlify(s), 16)
+    return int.from_bytes(s, 'big')
 
 class EOF(Exception): pass
 
@@ -258,6 +268,7 @@ class MatroskaElement(object):
         self.structname = 'ebml_' + self.fieldname
         self.elid = elid
         self.valtype = valtype
+        self.parent = None
         if valtype == 'sub':
             self.ebmltype = 'EBML_TYPE_SUBELEMENTS'
             self.valname = 'struct ' + self.structname
@@ -275,10 +286,15 @@ class MatroskaElement(object):
     def add_subelements(self, subelements):
         self.subelements = subelements
         self.subids = {x[0].elid for x in subelements}
+        for subel, multiple in subelements:
+            subel.parent = self
+        # Field order of the generated descriptors: sorted by ID, so that
+        # ebml_find_field() can use binary search.
+        self.fields = sorted(subelements, key=lambda x: int(x[0].elid, 16))
 
 elementd = {}
 elementlist = []
-def parse_elems(l, namespace):
+def parse_elems(l, namespace, elementd=elementd, elementlist=elementlist):
     subelements = []
     for el in l:
         if isinstance(el, str):
@@ -291,17 +307,137 @@ def parse_elems(l, namespace):
             elementlist.append(new)
             subelements.append((new, multiple))
         else:
-            new.add_subelements(parse_elems(el, namespace))
+            new.add_subelements(parse_elems(el, namespace, elementd,
+                                            elementlist))
     return subelements
 
 parse_elems(elements_ebml, 'EBML')
 parse_elems(elements_matroska, 'MATROSKA')
+elementd_by_name = {el.name: el for el in elementlist}
+
+def describe(el):
+    if el.parent is None:
+        return '{0} ({1}, top level)'.format(el.name, el.valtype)
+    return '{0} ({1}, in {2})'.format(el.name, el.valtype, el.parent.name)
+
+def check_elements(elements):
+    """
+    Return a list of problems with the parsed element tables: IDs that are
+    not valid EBML IDs, and IDs or names that are defined more than once (the
+    generated C code has one definition per element, so an element can't be
+    listed under two parents).
+    """
+    problems = []
+    by_id = {}
+    by_name = {}
+    for el in elements:
+        try:
+            elid = int(el.elid, 16)
+        except ValueError:
+            elid = None
+        length = len(el.elid) // 2
+        if elid is None or len(el.elid) % 2 or not 1 <= length <= 4:
+            problems.append('{0}: invalid ID {1}'.format(el.name, el.elid))
+            continue
+        marker = 1 << (8 * length - length)
+        data = elid & (marker - 1)
+        if elid >> (8 * length - length) != 1:
+            problems.append('{0}: ID {1} is not a valid {2} byte EBML ID'
+                            .format(el.name, el.elid, length))
+        elif data == marker - 1:
+            problems.append('{0}: ID {1} uses a reserved value'
+                            .format(el.name, el.elid))
+        elif length > 1 and data < (1 << (7 * (length - 1))) - 1:
+            problems.append('{0}: ID {1} could be encoded in fewer bytes'
+                            .format(el.name, el.elid))
+        if el.elid in by_id:
+            other = by_id[el.elid]
+            if (other.name, other.valtype) != (el.name, el.valtype):
+                problems.append('ID {0} has conflicting definitions: {1} and '
+                                '{2}'.format(el.elid, describe(other),
+                                             describe(el)))
+            else:
+                problems.append('ID {0} defined twice: {1} and {2}'.format(
+                                el.elid, describe(other), describe(el)))
+        by_id.setdefault(el.elid, el)
+        if el.fieldname in by_name and by_name[el.fieldname].elid != el.elid:
+            problems.append('{0} and {1} have the same C name {2}'.format(
+                            describe(by_name[el.fieldname]), describe(el),
+                            el.fieldname))
+        by_name.setdefault(el.fieldname, el)
+    return problems
+
+def check_tables():
+    problems = check_elements(elementlist)
+    if problems:
+        raise SyntaxError('Invalid element tables:\n' + '\n'.join(problems))
+
+def load_tables(filename):
+    """
+    Parse the element tables of another version of this file, without
+    running it, and return its list of elements.
+    """
+    with open(filename) as f:
+        tree = ast.parse(f.read(), filename)
+    tables = {}
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1 and
+                isinstance(node.targets[0], ast.Name)):
+            tables[node.targets[0].id] = node.value
+    elements = []
+    for name, namespace in (('elements_ebml', 'EBML'),
+                            ('elements_matroska', 'MATROSKA')):
+        if name not in tables:
+            raise SyntaxError('{0} not found in {1}'.format(name, filename))
+        parse_elems(ast.literal_eval(tables[name]), namespace, {}, elements)
+    return elements
+
+def diff_elements(old, new, out):
+    """
+    Print the differences between two versions of the element tables, as
+    they affect the generated code: elements added, removed or changed, the
+    structs whose fields change, and MAX_EBML_SUBELEMENTS (the size of the
+    per-element counting array in ebml_parse_element()).
+    """
+    oldd = {el.name: el for el in old}
+    newd = {el.name: el for el in new}
+    for name in sorted(set(oldd) - set(newd)):
+        printf(out, '-', describe(oldd[name]), oldd[name].elid)
+    for name in sorted(set(newd) - set(oldd)):
+        printf(out, '+', describe(newd[name]), newd[name].elid)
+    for name in sorted(set(oldd) & set(newd)):
+        a, b = oldd[name], newd[name]
+        if (a.elid, a.valtype) != (b.elid, b.valtype):
+            printf(out, '~', name, a.elid, a.valtype, '->', b.elid, b.valtype)
+
+    def fields(el):
+        return ['{0} {1}{2}'.format(subel.valname, ' *'[multiple].strip(),
+                                    subel.fieldname)
+                for subel, multiple in el.subelements]
+    for name in sorted(set(oldd) | set(newd)):
+        a = fields(oldd[name]) if name in oldd else []
+        b = fields(newd[name]) if name in newd else []
+        if a == b:
+            continue
+        el = newd.get(name) or oldd.get(name)
+        printf(out, 'struct {0}: {1} -> {2} fields'.format(el.structname,
+                                                           len(a), len(b)))
+        for f in a:
+            if f not in b:
+                printf(out, '    -', f)
+        for f in b:
+            if f not in a:
+                printf(out, '    +', f)
+
+    maxsub = [max(len(el.subelements) for el in l) for l in (old, new)]
+    printf(out, 'MAX_EBML_SUBELEMENTS:', maxsub[0], '->', maxsub[1])
 
 def printf(out, *args):
     out.write(' '.join(str(x) for x in args))
     out.write('\n')
 
 def generate_C_header(out):
+    check_tables()
     printf(out, '// Generated by TOOLS/matroska.py, do not edit manually')
     printf(out)
 
@@ -335,6 +471,7 @@ def generate_C_header(out):
 
 
 def generate_C_definitions(out):
+    check_tables()
     printf(out, '// Generated by TOOLS/matroska.py, do not edit manually')
     printf(out)
     for el in reversed(elementlist):
@@ -342,7 +479,12 @@ def generate_C_definitions(out):
         if el.subelements:
             printf(out, '#define N', el.fieldname)
             printf(out, 'E_S("{0}", {1})'.format(el.name, len(el.subelements)))
-            for subel, multiple in el.subelements:
+            # ebml_find_field() does a binary search over the fields
+            ids = [int(subel.elid, 16) for subel, multiple in el.fields]
+            if ids != sorted(set(ids)):
+                raise SyntaxError('Fields of {0} are not sorted by ID'
+                                  .format(el.name))
+            for subel, multiple in el.fields:
                 printf(out, 'F({0.definename}, {0.fieldname}, {1})'.format(
                             subel, int(multiple)))
             printf(out, '}};')
@@ -350,131 +492,1001 @@ def generate_C_definitions(out):
         else:
             printf(out, 'E("{0.name}", {0.fieldname}, {0.ebmltype})'.format(el))
 
+# Elements that get a specialized parse function in generated/ebml_parsers.inc,
+# instead of going through the generic descriptor-driven parser. Worth it for
+# elements that can occur hundreds of thousands of times in a file. (Blocks
+# are not in here, because demux_mkv.c reads them without the descriptors.)
+hot_elements = ('CuePoint', 'CueTrackPositions', 'Tag', 'SimpleTag')
+
+c_value_parsers = {
+    'uint': """\
+            if (length < 1 || length > 8) {
+                MP_ERR(ctx, "uint invalid length %"PRIu64"\\n", length);
+                break;
+            }
+            $ptr = ebml_parse_uint(data, length);
+            MP_TRACE(ctx, "uint %"PRIu64"\\n", $ptr);
+""",
+    'sint': """\
+            if (length > 8) {
+                MP_ERR(ctx, "sint invalid length %"PRIu64"\\n", length);
+                break;
+            }
+            $ptr = ebml_parse_sint(data, length);
+            MP_TRACE(ctx, "sint %"PRId64"\\n", $ptr);
+""",
+    'float': """\
+            if (length != 0 && length != 4 && length != 8) {
+                MP_ERR(ctx, "float invalid length %"PRIu64"\\n", length);
+                break;
+            }
+            $ptr = ebml_parse_float(data, length);
+            MP_DBG(ctx, "float %f\\n", $ptr);
+""",
+    'str': """\
+            if (length > 1024 * 1024) {
+                MP_ERR(ctx, "Not reading overly long string element.\\n");
+            } else {
+                $ptr = talloc_strndup(ctx->talloc_ctx, data, length);
+                MP_TRACE(ctx, "string \\"%s\\"\\n", $ptr);
+            }
+""",
+    'binary': """\
+            if (length > 0x80000000) {
+                MP_ERR(ctx, "Not reading overly long EBML element.\\n");
+            } else {
+                $ptr.start = data;
+                $ptr.len = length;
+                MP_TRACE(ctx, "binary %zd bytes\\n", $ptr.len);
+            }
+""",
+    'ebml_id': """\
+            int id_len;
+            $ptr = ebml_parse_id(data, end - data, &id_len);
+            if (id_len != length) {
+                MP_ERR(ctx, "ebml_id broken value\\n");
+                break;
+            }
+            MP_TRACE(ctx, "ebml_id %x\\n", (unsigned)$ptr);
+""",
+    'sub': """\
+            MP_TRACE(ctx, "subelements\\n");
+            $call;
+""",
+}
+
+c_parser_case = """\
+        case $define: {
+            if (!ebml_check_count(ctx, t->n_$field, num_elems[$index], $multiple,
+                                  id, "$name", length))
+                break;
+            MP_TRACE(ctx, "%.*sParsing %x %s size: %"PRIu64" value: ",
+                     level+1, "        ", id, "$name", length);
+$value\
+            t->n_$field++;
+            break;
+        }
+"""
+
+c_parser_alloc = """\
+    if (num_elems[$index])
+        t->$field = talloc_zero_array(ctx->talloc_ctx, $type, num_elems[$index]);
+"""
+
+c_parser_alloc_sub = """\
+    if (num_elems[$index]) {
+        size_t max = 1000000000 / sizeof($type);
+        if (num_elems[$index] > max) {
+            MP_ERR(ctx, "Too many subelements.\\n");
+            num_elems[$index] = max;
+        }
+        t->$field = talloc_zero_array(ctx->talloc_ctx, $type, num_elems[$index]);
+    }
+"""
+
+c_parser = """\
+// target must be initialized to zero
+static void ebml_parse_$field(struct ebml_parse_ctx *ctx,
+$indent struct ebml_$field *t,
+$indent uint8_t *data, int size, int level)
+{
+    assert(level < 8);
+    MP_TRACE(ctx, "%.*sParsing element %s\\n", level, "       ", "$name");
+
+    int num_elems[$count] = {0};
+    uint8_t *end = ebml_count_subelements(ctx, data, size,
+                                          &ebml_${field}_desc, num_elems);
+$allocs
+    while (data < end) {
+        uint32_t id;
+        uint64_t length;
+        if (!ebml_next_subelement(ctx, &data, end, &id, &length))
+            break;
+        switch (id) {
+$cases\
+        default:
+            ebml_skip_unknown(ctx, id, length, level);
+        }
+        data += length;
+    }
+}
+"""
+
+def generate_C_parsers(out, names=hot_elements):
+    check_tables()
+    hot = []
+    for name in names:
+        el = elementd_by_name.get(name)
+        if el is None or not el.subelements:
+            raise SyntaxError('Not an element with subelements: ' + name)
+        hot.append(el)
+    hotnames = {el.name for el in hot}
+
+    printf(out, '// Generated by TOOLS/matroska.py, do not edit manually')
+    printf(out)
+    for el in hot:
+        indent = ' ' * (len(el.fieldname) + 24)
+        printf(out, 'static void ebml_parse_{0}(struct ebml_parse_ctx *ctx,'
+                    .format(el.fieldname))
+        printf(out, '{0}struct ebml_{1} *t,'.format(indent, el.fieldname))
+        printf(out, '{0}uint8_t *data, int size, int level);'.format(indent))
+    for el in hot:
+        allocs = []
+        cases = []
+        for index, (subel, multiple) in enumerate(el.fields):
+            ptr = 't->' + subel.fieldname
+            if multiple:
+                ptr += '[t->n_{0}]'.format(subel.fieldname)
+                alloc = c_parser_alloc_sub if subel.subelements else c_parser_alloc
+                allocs.append(Template(alloc).substitute(
+                    index=index, field=subel.fieldname, type=subel.valname))
+            if subel.name in hotnames:
+                call = 'ebml_parse_{0}(ctx, &{1}, data, length, level + 1)'
+            else:
+                call = ('ebml_parse_element(ctx, &{1}, data, length,\n'
+                        '                               &ebml_{0}_desc, '
+                        'level + 1)')
+            value = Template(c_value_parsers[subel.valtype]).substitute(
+                ptr=ptr, call=call.format(subel.fieldname, ptr))
+            cases.append(Template(c_parser_case).substitute(
+                define=subel.definename, field=subel.fieldname, index=index,
+                multiple=['false', 'true'][multiple], name=subel.name,
+                value=value))
+        printf(out)
+        out.write(Template(c_parser).substitute(
+            field=el.fieldname, name=el.name, count=len(el.fields),
+            indent=' ' * (len(el.fieldname) + 23),
+            allocs=''.join(allocs), cases=''.join(cases)))
+
+    printf(out)
+    printf(out, 'static bool ebml_parse_generated(struct ebml_parse_ctx *ctx, '
+                'void *target,')
+    printf(out, '                                 uint8_t *data, int size,')
+    printf(out, '                                 const struct ebml_elem_desc '
+                '*type, int level)')
+    printf(out, '{')
+    for el in hot:
+        printf(out, '    if (type == &ebml_{0}_desc) {{'.format(el.fieldname))
+        printf(out, '        ebml_parse_{0}(ctx, target, data, size, level);'
+                    .format(el.fieldname))
+        printf(out, '        return true;')
+        printf(out, '    }')
+    printf(out, '    return false;')
+    printf(out, '}')
+
+def write_generated(filename, fn):
+    """
+    Write the output of fn(out) to filename ('-' for stdout). An existing file
+    with identical contents is left alone, so that its timestamp only changes
+    when the element tables do, and the C files including it aren't rebuilt.
+    """
+    out = StringIO()
+    fn(out)
+    if filename == '-':
+        sys.stdout.write(out.getvalue())
+        return
+    try:
+        with open(filename) as f:
+            if f.read() == out.getvalue():
+                return
+    except OSError:
+        pass
+    with open(filename, 'w') as f:
+        f.write(out.getvalue())
+
+class MappedFile(object):
+    """
+    Read-only, file-like view of a file that maps it into memory instead of
+    issuing a read() syscall per element. read() returns memoryview slices of
+    the mapping, so element payloads are never copied.
+    """
+
+    def __init__(self, f):
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = self.map
+        except (ValueError, OSError):
+            # empty files and pipes can't be mapped
+            self.map = None
+            data = f.read()
+        self.data = memoryview(data)
+        self.size = len(self.data)
+        self.pos = 0
+
+    def read(self, length):
+        pos = self.pos
+        end = pos + length
+        if end > self.size:
+            raise EOF
+        self.pos = end
+        return self.data[pos:end]
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def close(self):
+        try:
+            self.data.release()
+            if self.map is not None:
+                self.map.close()
+        except BufferError:
+            # Slices returned by read() are still referenced somewhere; the
+            # mapping is released once they are gone.
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 def read(s, length):
-    t = s.read(length)
-    if len(t) != length:
-        raise EOF
-    return t
+    return s.read(length)
 
 def read_id(s):
-    t = read(s, 1)
-    i = 0
-    mask = 128
-    if ord(t) == 0:
+    pos = s.pos
+    if pos >= s.size:
+        raise EOF
+    t = s.data[pos]
+    if t == 0:
         raise SyntaxError
-    while not ord(t) & mask:
+    i = 1
+    mask = 128
+    while not t & mask:
         i += 1
         mask >>= 1
-    t += read(s, i)
-    return t
+    return read(s, i)
 
 def read_vint(s):
-    t = read(s, 1)
+    pos = s.pos
+    if pos >= s.size:
+        raise EOF
+    t = s.data[pos]
+    if t == 0:
+        raise SyntaxError
     i = 0
     mask = 128
-    if ord(t) == 0:
-        raise SyntaxError
-    while not ord(t) & mask:
+    while not t & mask:
         i += 1
         mask >>= 1
-    t = bytes((ord(t) & (mask - 1),))
-    t += read(s, i)
-    return i+1, byte2num(t)
+    rest = read(s, i + 1)[1:]
+    return i+1, ((t & (mask - 1)) << (8 * i)) | byte2num(rest)
 
 def read_str(s, length):
     return read(s, length)
 
 def read_uint(s, length):
-    t = read(s, length)
-    return byte2num(t)
+    return byte2num(read(s, length))
 
 def read_sint(s, length):
-    i = read_uint(s, length)
-    mask = 1 << (length * 8 - 1)
-    if i & mask:
-        i -= 2 * mask
-    return i
+    return int.from_bytes(read(s, length), 'big', signed=True)
 
 def read_float(s, length):
     t = read(s, length)
-    i = byte2num(t)
     if length == 4:
-        f = ldexp((i & 0x7fffff) + (1 << 23), (i >> 23 & 0xff) - 150)
-        if i & (1 << 31):
-            f = -f
+        return struct.unpack('>f', t)[0]
     elif length == 8:
-        f = ldexp((i & ((1 << 52) - 1)) + (1 << 52), (i >> 52 & 0x7ff) - 1075)
-        if i & (1 << 63):
-            f = -f
-    else:
-        raise SyntaxError
-    return f
+        return struct.unpack('>d', t)[0]
+    elif length == 0:
+        return 0.0
+    raise SyntaxError
+
+def skip(s, length):
+    s.seek(s.tell() + length)
+
+class UnknownElement(object):
+    """Stand-in for element IDs that are not in the tables above."""
 
-def parse_one(s, depth, parent, maxlen):
+    name = None
+    valtype = 'binary'
+
+    def __init__(self, elid):
+        self.elid = elid
+
+def read_value(s, elem, length):
+    valtype = elem.valtype
+    if valtype == 'uint':
+        return read_uint(s, length)
+    elif valtype == 'sint':
+        return read_sint(s, length)
+    elif valtype == 'float':
+        return read_float(s, length)
+    elif valtype == 'str':
+        return str(read_str(s, length), 'utf8', 'replace')
+    elif valtype == 'binary':
+        return read_str(s, length)
+    elif valtype == 'ebml_id':
+        return hexlify(read_str(s, length)).decode('ascii')
+    raise NotImplementedError
+
+def read_element_header(s):
+    """
+    Read an element ID and size. The size is None for elements of unknown
+    size (all size bits set), which live streams use for Segment and Cluster.
+    """
     elid = hexlify(read_id(s)).decode('ascii')
-    elem = elementd.get(elid)
     size, length = read_vint(s)
-    this_length = len(elid) / 2 + size + length
-    if elem is not None:
-        if elem.valtype != 'skip':
-            print("    " * depth, '[' + elid + ']', elem.name, 'size:', length, 'value:', end=' ')
+    if length == (1 << (7 * size)) - 1:
+        length = None
+    return elid, length
+
+# Void and CRC32 can appear in any master element.
+global_ids = {elementd_by_name['Void'].elid, elementd_by_name['CRC32'].elid}
+
+def is_child(elid, parent):
+    """
+    Whether an element with the given ID can be part of parent. Used to find
+    the end of elements of unknown size, which is the first element that
+    can't be one of their children. Unknown IDs are assumed to be children.
+    """
+    return elid in parent.subids or elid in global_ids or elid not in elementd
+
+def prune_all(depth, elem):
+    return True
+
+def iter_elements(s, end=None, depth=0, max_depth=None, prune=None,
+                  parent=None):
+    """
+    Lazily parse the elements starting at the current position of s (a
+    MappedFile) and yield a (depth, offset, element, size, value) tuple for
+    each of them, in file order. offset is the position of the element ID and
+    size the length of the payload, or None for master elements of unknown
+    size. element is a MatroskaElement, or an UnknownElement for IDs missing
+    from the tables.
+
+    value is None for master elements, which are yielded before their
+    children, with s positioned at the start of their payload. Binary payloads
+    are returned as memoryviews into the mapping and are not copied.
+
+    Parsing stops at offset end, or at the end of the file if end is None.
+    If parent is given, the elements are the children of a master element of
+    unknown size, and parsing also stops (with s positioned before it) at the
+    first element that isn't a child of parent. Master elements at max_depth
+    are not descended into. prune(depth, element) is called for every
+    element; if it returns true, the element's payload is skipped without
+    being parsed, and value is None.
+    """
+    while end is None or s.pos < end:
+        offset = s.pos
+        try:
+            elid, length = read_element_header(s)
+        except EOF:
+            # (a skipped payload can also end past the end of the file)
+            if end is None and s.pos == offset == s.size:
+                return
+            raise
+        if parent is not None and not is_child(elid, parent):
+            s.seek(offset)
+            return
+        elem = elementd.get(elid)
+        if elem is None:
+            elem = UnknownElement(elid)
+        if length is None:
+            if elem.valtype != 'sub':
+                raise SyntaxError('element {0} at {1} has unknown size, but '
+                                  'no subelements'.format(elid, offset))
+            yield depth, offset, elem, None, None
+            if ((max_depth is not None and depth >= max_depth) or
+                    (prune is not None and prune(depth, elem))):
+                # the end can only be found by parsing the children
+                for ev in iter_elements(s, end, depth + 1, None, prune_all,
+                                        elem):
+                    pass
+            else:
+                for ev in iter_elements(s, end, depth + 1, max_depth, prune,
+                                        elem):
+                    yield ev
+            continue
+        data_end = s.pos + length
+        if end is not None and data_end > end:
+            raise SyntaxError('element {0} at {1} goes past the end of its '
+                              'parent'.format(elid, offset))
+        if elem.valtype == 'sub':
+            yield depth, offset, elem, length, None
+            if ((max_depth is not None and depth >= max_depth) or
+                    (prune is not None and prune(depth, elem))):
+                s.seek(data_end)
+            else:
+                for ev in iter_elements(s, data_end, depth + 1, max_depth,
+                                        prune):
+                    yield ev
+        elif prune is not None and prune(depth, elem):
+            s.seek(data_end)
+            yield depth, offset, elem, length, None
+        else:
+            yield depth, offset, elem, length, read_value(s, elem, length)
+
+# Elements whose contents --headers-only seeks over instead of descending into.
+headers_only_skip = ('Cluster',)
+
+def prune_headers_only(depth, elem):
+    return elem.name in headers_only_skip or elem.valtype == 'binary'
+
+def dump(s, max_depth=None, headers_only=False):
+    prune = prune_headers_only if headers_only else None
+    for depth, offset, elem, length, value in iter_elements(
+            s, max_depth=max_depth, prune=prune):
+        if length is None:
+            length = 'unknown'
+        if elem.name is None:
+            print("    " * depth, '[' + elem.elid + '] Unknown element! size:', length)
+            continue
+        print("    " * depth, '[' + elem.elid + ']', elem.name, 'size:', length, 'value:', end=' ')
         if elem.valtype == 'sub':
-            print('subelements:')
-            while length > 0:
-                length -= parse_one(s, depth + 1, elem, length)
-            if length < 0:
-                raise SyntaxError
+            if depth == max_depth or (prune and prune(depth, elem)):
+                print('subelements: skipped')
+            else:
+                print('subelements:')
         elif elem.valtype == 'str':
-            print('string', repr(read_str(s, length).decode('utf8', 'replace')))
+            print('string', repr(value))
         elif elem.valtype in ('binary', 'ebml_id'):
-            t = read_str(s, length)
             dec = ''
             if elem.valtype == 'ebml_id':
-                idelem = elementd.get(hexlify(t).decode('ascii'))
+                idelem = elementd.get(value)
                 if idelem is None:
                     dec = '(UNKNOWN)'
                 else:
                     dec = '({0.name})'.format(idelem)
-            if len(t) < 20:
-                t = hexlify(t).decode('ascii')
+            elif value is None or len(value) >= 20:
+                value = '<{0} bytes>'.format(length)
             else:
-                t = '<{0} bytes>'.format(len(t))
-            print('binary', t, dec)
-        elif elem.valtype == 'uint':
-            print('uint', read_uint(s, length))
-        elif elem.valtype == 'sint':
-            print('sint', read_sint(s, length))
-        elif elem.valtype == 'float':
-            print('float', read_float(s, length))
-        elif elem.valtype == 'skip':
-            read(s, length)
+                value = hexlify(value).decode('ascii')
+            print('binary', value, dec)
         else:
-            raise NotImplementedError
+            print(elem.valtype, value)
+
+class MatroskaIndex(object):
+    """
+    Maps timestamps to the file offsets of the clusters containing them. The
+    entries are kept in parallel arrays sorted by time: times is in
+    TimecodeScale units, positions are absolute file offsets, and tracks is
+    the CueTrack of each entry (0 for entries from a cluster scan, which apply
+    to all tracks).
+    """
+
+    header = struct.Struct('<8sQQqQ')
+    magic = b'MKVIDX01'
+
+    def __init__(self, timecode_scale, times, positions, tracks):
+        self.timecode_scale = timecode_scale
+        order = sorted(range(len(times)), key=lambda i: (times[i], positions[i]))
+        self.times = array('Q', (times[i] for i in order))
+        self.positions = array('Q', (positions[i] for i in order))
+        self.tracks = array('Q', (tracks[i] for i in order))
+
+    def __len__(self):
+        return len(self.times)
+
+    def lookup(self, seconds, track=None):
+        """
+        Return the offset of the last indexed cluster starting at or before
+        the given time (of the given track, if not None).
+        """
+        ticks = int(seconds * 1e9 / self.timecode_scale)
+        i = bisect_right(self.times, ticks) - 1
+        while i >= 0:
+            if track is None or self.tracks[i] in (0, track):
+                return self.positions[i]
+            i -= 1
+        return self.positions[0] if len(self) else None
+
+    def save(self, filename, st):
+        with open(filename, 'wb') as f:
+            f.write(self.header.pack(self.magic, self.timecode_scale,
+                                     st.st_size, st.st_mtime_ns, len(self)))
+            for a in (self.times, self.positions, self.tracks):
+                if sys.byteorder != 'little':
+                    a = array(a.typecode, a)
+                    a.byteswap()
+                a.tofile(f)
+
+    @classmethod
+    def load(cls, filename, st):
+        """Load a saved index; return None if it's missing or out of date."""
+        try:
+            f = open(filename, 'rb')
+        except OSError:
+            return None
+        with f:
+            head = f.read(cls.header.size)
+            if len(head) != cls.header.size:
+                return None
+            magic, scale, size, mtime, count = cls.header.unpack(head)
+            if (magic != cls.magic or size != st.st_size or
+                    mtime != st.st_mtime_ns):
+                return None
+            arrays = []
+            for i in range(3):
+                a = array('Q')
+                try:
+                    a.fromfile(f, count)
+                except EOFError:
+                    return None
+                if sys.byteorder != 'little':
+                    a.byteswap()
+                arrays.append(a)
+        index = cls.__new__(cls)
+        index.timecode_scale = scale
+        index.times, index.positions, index.tracks = arrays
+        return index
+
+def read_cues(s, pos):
+    times, positions, tracks = array('Q'), array('Q'), array('Q')
+    segment_start = pos[1]
+    s.seek(pos[0])
+    elid, length = read_element_header(s)
+    cues = elementd_by_name['Cues']
+    if elid != cues.elid:
+        raise SyntaxError('no Cues element at {0}'.format(pos[0]))
+    if length is None:
+        end, parent = None, cues
+    else:
+        end, parent = s.pos + length, None
+    time = None
+    points = []
+    def flush():
+        for track, cluster in points:
+            times.append(time or 0)
+            positions.append(segment_start + cluster)
+            tracks.append(track)
+        del points[:]
+    for depth, offset, elem, size, value in iter_elements(s, end, 1,
+                                                          parent=parent):
+        if elem.name == 'CuePoint':
+            flush()
+            time = None
+        elif elem.name == 'CueTime':
+            time = value
+        elif elem.name == 'CueTrackPositions':
+            points.append([0, 0])
+        elif elem.name == 'CueTrack' and points:
+            points[-1][0] = value
+        elif elem.name == 'CueClusterPosition' and points:
+            points[-1][1] = value
+    flush()
+    return times, positions, tracks
+
+def build_index(s):
+    """
+    Build a MatroskaIndex for the first segment of the file. The Cues are
+    located through the SeekHead (or found on the way) and used if present;
+    otherwise the clusters are scanned, reading only their Timecode element.
+    """
+    s.seek(0)
+    for depth, offset, elem, size, value in iter_elements(s, max_depth=0):
+        if elem.name == 'Segment':
+            segment_start = s.tell()
+            segment_end = s.size
+            # end of the children of elements of unknown size
+            children_end = None
+            if size is not None:
+                segment_end = min(segment_start + size, s.size)
+                children_end = segment_start + size
+            break
     else:
-        print("    " * depth, '[' + elid + '] Unknown element! size:', length)
-        read(s, length)
-    return this_length
+        raise SyntaxError('no Segment element')
+
+    timecode_scale = 1000000
+    cues = None
+    times, positions, tracks = array('Q'), array('Q'), array('Q')
+    not_timecode = lambda depth, elem: elem.name != 'Timecode'
+    cues_id = elementd_by_name['Cues'].elid
+    s.seek(segment_start)
+    try:
+        while s.pos < segment_end:
+            offset = s.pos
+            elid, length = read_element_header(s)
+            data_start = s.pos
+            elem = elementd.get(elid)
+            name = elem.name if elem is not None else None
+            if length is not None:
+                end, parent = data_start + length, None
+            elif name is not None and elem.valtype == 'sub':
+                # unknown size: ends where an element that isn't a child is
+                end, parent = children_end, elem
+            else:
+                raise SyntaxError('element {0} at {1} has unknown size, but '
+                                  'no subelements'.format(elid, offset))
+            if name == 'Info':
+                for ev in iter_elements(s, end, 2, parent=parent):
+                    if ev[2].name == 'TimecodeScale':
+                        timecode_scale = ev[4]
+            elif name == 'SeekHead':
+                seek_id = None
+                for ev in iter_elements(s, end, 2, parent=parent):
+                    if ev[2].name == 'SeekID':
+                        seek_id = ev[4]
+                    elif ev[2].name == 'SeekPosition' and seek_id == cues_id:
+                        cues = (segment_start + ev[4], segment_start)
+            elif name == 'Cues':
+                cues = (offset, segment_start)
+            elif name == 'Cluster':
+                if cues is not None:
+                    try:
+                        return MatroskaIndex(timecode_scale, *read_cues(s, cues))
+                    except (EOF, SyntaxError):
+                        # The SeekHead entry is broken, or the file truncated.
+                        cues = None
+                        s.seek(data_start)
+                for ev in iter_elements(s, end, 2, prune=not_timecode,
+                                        parent=parent):
+                    if ev[2].name == 'Timecode':
+                        times.append(ev[4])
+                        positions.append(offset)
+                        tracks.append(0)
+                        break
+            if parent is None:
+                s.seek(end)
+            else:
+                # skip the rest of the element to find where it ends
+                for ev in iter_elements(s, end, 2, prune=prune_all,
+                                        parent=parent):
+                    pass
+    except EOF:
+        pass # truncated file; index what is there
+
+    if cues is not None:
+        try:
+            times, positions, tracks = read_cues(s, cues)
+        except (EOF, SyntaxError):
+            pass
+    return MatroskaIndex(timecode_scale, times, positions, tracks)
+
+def index_filename(filename):
+    # Not .idx: mpv would autoload FILE.mkv.idx as a VobSub subtitle of FILE.mkv
+    # (with "mkv" taken as the language).
+    return filename + '.mkvindex'
+
+def get_index(filename, s):
+    """Return the cached index of filename, rebuilding it if necessary."""
+    st = os.stat(filename)
+    index = MatroskaIndex.load(index_filename(filename), st)
+    if index is None:
+        index = build_index(s)
+        try:
+            index.save(index_filename(filename), st)
+        except OSError:
+            pass # e.g. read-only directory; the index is still usable
+    return index
+
+def validate(s, max_errors=100):
+    """
+    Check the structure of a Matroska file and return a list of problems
+    found. This checks that elements fit into their parents, that IDs and
+    sizes respect EBMLMaxIDLength and EBMLMaxSizeLength, that CRC32 elements
+    match the data following them, and that cluster timecodes don't go back.
+    The file has to start with an EBML header with a matroska or webm
+    DocType, and contain a Segment. Master elements of unknown size are
+    allowed; they end at the first element that can't be one of their
+    children.
+    """
+    errors = []
+    def error(offset, msg, *args):
+        if len(errors) < max_errors:
+            errors.append('{0}: {1}'.format(offset, msg.format(*args)))
+    max_id_length = 4
+    max_size_length = 8
+    parents = []
+    last_timecode = None
+    has_header = False
+    doctype = None
+    segments = 0
+    # CRC32 elements in parents of unknown size, checked when their end is
+    # found: (depth of the parent, parent, offset of the CRC32 element, start
+    # of the data, CRC32 value)
+    pending_crcs = []
+    def check_crcs(depth, end):
+        while pending_crcs and pending_crcs[-1][0] >= depth:
+            parent_depth, parent, offset, start, value = pending_crcs.pop()
+            if zlib.crc32(s.data[start:end]) != int.from_bytes(value, 'little'):
+                error(offset, 'CRC32 mismatch in {0}', parent.name)
+    def prune(depth, elem):
+        return elem.valtype == 'binary' and elem.name != 'CRC32'
+    try:
+        for depth, offset, elem, size, value in iter_elements(s, prune=prune):
+            check_crcs(depth, offset)
+            del parents[depth:]
+            data_start = s.pos if elem.valtype == 'sub' else s.pos - size
+            id_length = len(elem.elid) // 2
+            if id_length > max_id_length:
+                error(offset, 'ID {0} longer than EBMLMaxIDLength ({1})',
+                      elem.elid, max_id_length)
+            if data_start - offset - id_length > max_size_length:
+                error(offset, 'size of {0} longer than EBMLMaxSizeLength ({1})',
+                      elem.elid, max_size_length)
+            name = elem.name
+            if depth == 0:
+                if offset == 0:
+                    has_header = name == 'EBML'
+                if name == 'Segment':
+                    segments += 1
+            if depth == 1 and name == 'DocType' and parents[0][0].name == 'EBML':
+                # the string may be padded with zero bytes
+                doctype = value.rstrip('\0')
+            if name == 'EBMLMaxIDLength':
+                max_id_length = value
+            elif name == 'EBMLMaxSizeLength':
+                max_size_length = value
+            elif name == 'CRC32' and parents:
+                parent, parent_end = parents[-1]
+                if size != 4:
+                    error(offset, 'CRC32 element with size {0}', size)
+                elif parent_end is None:
+                    pending_crcs.append((depth - 1, parent, offset, s.pos, value))
+                elif (zlib.crc32(s.data[s.pos:parent_end]) !=
+                      int.from_bytes(value, 'little')):
+                    error(offset, 'CRC32 mismatch in {0}', parent.name)
+            elif name == 'Timecode':
+                if last_timecode is not None and value < last_timecode:
+                    error(offset, 'cluster timecode {0} after {1}',
+                          value, last_timecode)
+                last_timecode = value
+            if elem.valtype == 'sub':
+                parents.append((elem, None if size is None
+                                      else data_start + size))
+        check_crcs(0, s.pos)
+    except EOF:
+        error(s.size, 'unexpected end of file')
+    except SyntaxError as e:
+        error(s.pos, 'invalid element structure: {0}', e)
+    if not has_header:
+        error(0, 'no EBML header at the start of the file')
+    elif doctype is None:
+        error(0, 'no DocType in the EBML header')
+    elif doctype not in ('matroska', 'webm'):
+        error(0, 'DocType {0!r} is not matroska or webm', doctype)
+    if not segments:
+        error(s.size, 'no Segment')
+    if len(errors) == max_errors:
+        errors.append('too many errors')
+    return errors
+
+def validate_file(filename):
+    report = {'file': filename}
+    try:
+        with open(filename, "rb") as f, MappedFile(f) as s:
+            report['size'] = s.size
+            report['errors'] = validate(s)
+    except OSError as e:
+        report['errors'] = [str(e)]
+    report['ok'] = not report['errors']
+    return report
+
+matroska_extensions = ('.mkv', '.mka', '.mks', '.mk3d', '.webm')
+
+def find_matroska_files(paths):
+    """
+    Expand a list of paths to files: directories are searched recursively
+    for Matroska files, and '-' reads a list of filenames from stdin.
+    """
+    for path in paths:
+        if path == '-':
+            for line in sys.stdin:
+                if line.strip():
+                    yield line.rstrip('\n')
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(matroska_extensions):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def collect_blocks(s):
+    """
+    Walk all clusters and return the TimecodeScale and parallel arrays with,
+    for every SimpleBlock and Block: the offset and size of its payload, the
+    timecode of its cluster, and whether it is a keyframe (1), not a keyframe
+    (0), or has to be decided from the SimpleBlock flags (2). The block
+    payloads themselves are not read.
+    """
+    timecode_scale = 1000000
+    offsets, sizes, cluster_times = array('Q'), array('Q'), array('q')
+    keys = array('B')
+    cluster_time = 0
+    group_block = None
+    group_ref = False
+    def prune(depth, elem):
+        return elem.valtype == 'binary'
+    events = iter_elements(s, prune=prune)
+    while True:
+        try:
+            depth, offset, elem, size, value = next(events)
+        except (StopIteration, EOF):
+            # a truncated file is handled up to the point where it stops
+            break
+        name = elem.name
+        if name == 'Timecode':
+            cluster_time = value
+        elif name == 'TimecodeScale':
+            timecode_scale = value
+        elif name == 'BlockGroup':
+            group_block = None
+            group_ref = False
+        elif name == 'ReferenceBlock':
+            group_ref = True
+            if group_block is not None:
+                keys[group_block] = 0
+        elif name in ('SimpleBlock', 'Block'):
+            # 4 bytes is the smallest possible block header
+            if size < 4 or s.pos > s.size:
+                continue
+            offsets.append(s.pos - size)
+            sizes.append(size)
+            cluster_times.append(cluster_time)
+            if name == 'SimpleBlock':
+                keys.append(2)
+            else:
+                group_block = len(keys)
+                keys.append(0 if group_ref else 1)
+    return timecode_scale, offsets, sizes, cluster_times, keys
+
+def block_stats(s, interval=1.0):
+    """
+    Decode the headers of all blocks in the file (track number, relative
+    timecode, flags and lace count) with NumPy, and return per-track
+    statistics: totals, bitrate per interval (in kbit/s), keyframe intervals
+    and the distribution of lace counts.
+    """
+    import numpy as np
+
+    scale, offsets, sizes, cluster_times, keys = collect_blocks(s)
+    data = np.frombuffer(s.data, dtype=np.uint8)
+    off = np.frombuffer(offsets, dtype=np.uint64).astype(np.int64)
+    sizes = np.frombuffer(sizes, dtype=np.uint64).astype(np.int64)
+    keys = np.frombuffer(keys, dtype=np.uint8)
+
+    # track number vint
+    first = data[off].astype(np.int64)
+    lens = np.ones(len(off), dtype=np.int64)
+    for i in range(1, 8):
+        lens += first < (0x100 >> i)
+    track = first & ((1 << (8 - lens)) - 1)
+    for i in range(1, int(lens.max(initial=1))):
+        more = lens > i
+        track[more] = (track[more] << 8) | data[off[more] + i]
+    pos = np.minimum(off + lens, len(data) - 4)
+
+    timecode = (data[pos].astype(np.int64) << 8) | data[pos + 1]
+    timecode -= (timecode & 0x8000) << 1
+    flags = data[pos + 2]
+    lacing = (flags >> 1) & 3
+    laces = np.where(lacing != 0, data[pos + 3].astype(np.int64) + 1, 1)
+    keyframe = np.where(keys == 2, (flags & 0x80) != 0, keys == 1)
+    times = ((np.frombuffer(cluster_times, dtype=np.int64) + timecode) *
+             (scale / 1e9))
+    del data
+
+    stats = []
+    for t in np.unique(track):
+        sel = track == t
+        t_times, t_sizes = times[sel], sizes[sel]
+        bins = ((t_times - t_times.min()) // interval).astype(np.int64)
+        bitrate = np.bincount(bins, weights=t_sizes) * 8 / interval / 1000
+        key_times = np.sort(t_times[keyframe[sel]])
+        key_intervals = np.diff(key_times)
+        lace_counts, lace_blocks = np.unique(laces[sel], return_counts=True)
+        stats.append({
+            'track': int(t),
+            'blocks': int(sel.sum()),
+            'frames': int(laces[sel].sum()),
+            'bytes': int(t_sizes.sum()),
+            'start': float(t_times.min()),
+            'end': float(t_times.max()),
+            'keyframes': len(key_times),
+            'keyframe_interval': {
+                'min': float(key_intervals.min()),
+                'mean': float(key_intervals.mean()),
+                'max': float(key_intervals.max()),
+            } if len(key_intervals) else None,
+            'laces': {int(c): int(n) for c, n in zip(lace_counts, lace_blocks)},
+            'bitrate': [round(float(b), 3) for b in bitrate],
+        })
+    return stats
 
 if __name__ == "__main__":
-    def parse_toplevel(s):
-        parse_one(s, 0, None, 1 << 63)
+    import argparse
 
-    if len(sys.argv) < 3:
-        outfile = sys.stdout
-    else:
-        outfile = open(sys.argv[2], "w")
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--generate-header', metavar='OUTFILE', nargs='?',
+                      const='-', help='write generated/ebml_types.h')
+    mode.add_argument('--generate-definitions', metavar='OUTFILE', nargs='?',
+                      const='-', help='write generated/ebml_defs.inc')
+    mode.add_argument('--generate-parsers', metavar='OUTFILE', nargs='?',
+                      const='-', help='write generated/ebml_parsers.inc')
+    mode.add_argument('--check', action='store_true',
+                      help='check the element tables for errors')
+    mode.add_argument('--diff', metavar='OLD_MATROSKA_PY',
+                      help='show how the element tables differ from those '
+                           'in another version of this script')
+    mode.add_argument('file', nargs='?', help='Matroska file to dump')
+    mode.add_argument('--validate', nargs='+', metavar='PATH',
+                      help='check files (directories are searched, - reads '
+                           'names from stdin) and print JSON lines reports')
+    parser.add_argument('--hot-elements', metavar='NAMES',
+                        default=','.join(hot_elements),
+                        help='comma-separated elements to generate parsers '
+                             'for (default: %(default)s)')
+    parser.add_argument('--headers-only', action='store_true',
+                        help='seek over cluster contents and binary payloads')
+    parser.add_argument('--max-depth', type=int, metavar='N',
+                        help='do not show elements nested deeper than N')
+    parser.add_argument('--index', action='store_true',
+                        help='build the seek index sidecar (FILE.mkvindex)')
+    parser.add_argument('--seek', type=float, metavar='SECONDS',
+                        help='print the offset of the cluster for SECONDS, '
+                             'using the cached index')
+    parser.add_argument('--block-stats', action='store_true',
+                        help='print per-track block statistics as JSON '
+                             '(requires NumPy)')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        metavar='SECONDS',
+                        help='bitrate interval for --block-stats')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of --validate worker processes')
+    args = parser.parse_args()
 
-    if sys.argv[1] == '--generate-header':
-        generate_C_header(outfile)
-    elif sys.argv[1] == '--generate-definitions':
-        generate_C_definitions(outfile)
+    if args.generate_header:
+        write_generated(args.generate_header, generate_C_header)
+    elif args.generate_definitions:
+        write_generated(args.generate_definitions, generate_C_definitions)
+    elif args.generate_parsers:
+        names = [n for n in args.hot_elements.split(',') if n]
+        write_generated(args.generate_parsers,
+                        lambda out: generate_C_parsers(out, names))
+    elif args.check:
+        problems = check_elements(elementlist)
+        for p in problems:
+            print(p)
+        sys.exit(1 if problems else 0)
+    elif args.diff:
+        diff_elements(load_tables(args.diff), elementlist, sys.stdout)
+    elif args.validate:
+        ok = True
+        files = find_matroska_files(args.validate)
+        with ProcessPoolExecutor(args.jobs) as pool:
+            for report in pool.map(validate_file, files, chunksize=4):
+                ok = ok and report['ok']
+                print(json.dumps(report), flush=True)
+        sys.exit(0 if ok else 1)
     else:
-        s = open(sys.argv[1], "rb")
-        while 1:
-            start = s.tell()
-            try:
-                parse_toplevel(s)
-            except EOF:
-                if s.tell() != start:
+        with open(args.file, "rb") as f, MappedFile(f) as s:
+            if args.index:
+                index = build_index(s)
+                index.save(index_filename(args.file), os.stat(args.file))
+                print('{0}: {1} entries'.format(index_filename(args.file),
+                                                len(index)))
+            elif args.block_stats:
+                print(json.dumps(block_stats(s, args.interval), indent=4))
+            elif args.seek is not None:
+                print(get_index(args.file, s).lookup(args.seek))
+            else:
+                try:
+                    dump(s, args.max_depth, args.headers_only)
+                except EOF:
                     raise Exception("Unexpected end of file")
-                break
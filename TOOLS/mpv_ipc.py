@@ -0,0 +1,283 @@
+"""
+asyncio client for mpv's JSON IPC protocol (see --input-ipc-server and
+DOCS/man/ipc.rst). Each connection is served by a single reader task, so one
+process can drive many mpv instances without a thread per socket.
+
+Example:
+
+    import asyncio
+    import mpv_ipc
+
+    async def main():
+        async with await mpv_ipc.connect("/tmp/mpvsocket") as mpv:
+            await mpv.command("loadfile", "video.mkv")
+            print(await mpv.get_property("path"))
+            async with mpv.observe_property("pause") as values:
+                async for pause in values:
+                    print("pause:", pause)
+
+    asyncio.run(main())
+
+Commands are pipelined: any number of coroutines can send commands on the same
+connection concurrently, and each gets the reply matching its request_id. The
+number of commands in flight is limited (max_pending), and sending waits until
+the socket accepts more data.
+
+Property observers only keep the latest value, so a slow consumer skips
+intermediate values instead of making them pile up. The events() iterator keeps
+up to queue_size events; if it is full, reading from the socket stops until the
+consumer catches up. This also delays command replies, so don't wait for a
+reply in the task that is supposed to consume the events.
+"""
+
+import asyncio
+import json
+
+class MPVError(Exception):
+    """
+    A command failed. error is mpv's error string, command the failed command.
+    """
+    def __init__(self, error, command):
+        super().__init__("%s: %s" % (json.dumps(command), error))
+        self.error = error
+        self.command = command
+
+class ConnectionClosed(ConnectionError):
+    """
+    The connection to mpv was closed.
+    """
+    pass
+
+_closed = object()
+
+class _PropertyObserver:
+    """
+    Async iterator over the values of a property; see Client.observe_property.
+    """
+    def __init__(self, client, name, string):
+        self._client = client
+        self._name = name
+        self._string = string
+        self._id = None
+        self._value = None
+        self._changed = asyncio.Event()
+
+    async def __aenter__(self):
+        client = self._client
+        self._id = client._next_observe_id
+        client._next_observe_id += 1
+        client._observers[self._id] = self
+        cmd = "observe_property_string" if self._string else "observe_property"
+        try:
+            await client.command(cmd, self._id, self._name)
+        except BaseException:
+            del client._observers[self._id]
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        client = self._client
+        del client._observers[self._id]
+        try:
+            await client.command("unobserve_property", self._id)
+        except ConnectionClosed:
+            pass
+
+    def _update(self, value):
+        self._value = value
+        self._changed.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self._changed.wait()
+        self._changed.clear()
+        if self._value is _closed:
+            raise StopAsyncIteration
+        return self._value
+
+class _EventQueue:
+    """
+    Async iterator over all events; see Client.events.
+    """
+    def __init__(self, client, size):
+        self._client = client
+        self._queue = asyncio.Queue(size)
+
+    async def __aenter__(self):
+        self._client._event_queues.add(self)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._client._event_queues.discard(self)
+        # unblock the reader if it's waiting for room in the queue
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    def _close(self):
+        # make room for the end marker, dropping the oldest event if needed
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(_closed)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self._queue.get()
+        if event is _closed:
+            raise StopAsyncIteration
+        return event
+
+class Client:
+    """
+    A connection to mpv. Use connect() to create one.
+    """
+    def __init__(self, reader, writer, max_pending=64, queue_size=256):
+        self._reader = reader
+        self._writer = writer
+        self._queue_size = queue_size
+        self._slots = asyncio.Semaphore(max_pending)
+        self._pending = {}
+        self._next_request_id = 1
+        self._observers = {}
+        self._next_observe_id = 1
+        self._event_queues = set()
+        self._error = None
+        self._task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    @property
+    def closed(self):
+        return self._error is not None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if not self.closed:
+            self._writer.close()
+        await self._task
+
+    async def wait_closed(self):
+        """
+        Wait until the connection is closed (by either side).
+        """
+        await asyncio.shield(self._task)
+
+    async def request(self, command, async_=False):
+        """
+        Run command (a list) and return the data of the reply. Raises MPVError
+        if the command fails, and ConnectionClosed if the connection is lost
+        before the reply arrives. If async_ is set, the command is run with
+        "async": true, which lets mpv run it in the background.
+        """
+        async with self._slots:
+            if self._error:
+                raise self._error
+            request_id = self._next_request_id
+            self._next_request_id += 1
+            msg = {"command": command, "request_id": request_id}
+            if async_:
+                msg["async"] = True
+            future = asyncio.get_running_loop().create_future()
+            self._pending[request_id] = future
+            try:
+                # mpv's JSON parser doesn't accept UTF-16 surrogate pairs in
+                # \u escapes, so send UTF-8 instead
+                data = json.dumps(msg, ensure_ascii=False) + "\n"
+                try:
+                    self._writer.write(data.encode("utf-8", "surrogateescape"))
+                    await self._writer.drain()
+                except OSError as e:
+                    raise ConnectionClosed("connection to mpv closed") from e
+                reply = await future
+            finally:
+                del self._pending[request_id]
+                # the reader may have failed it if we didn't get to wait for it
+                if not future.done():
+                    future.cancel()
+                elif not future.cancelled():
+                    future.exception()
+        if reply.get("error") != "success":
+            raise MPVError(reply.get("error"), command)
+        return reply.get("data")
+
+    async def command(self, *args, async_=False):
+        """
+        Like request(), with the command as arguments:
+        await mpv.command("seek", 10, "relative").
+        """
+        return await self.request(list(args), async_)
+
+    async def get_property(self, name):
+        return await self.command("get_property", name)
+
+    async def set_property(self, name, value):
+        return await self.command("set_property", name, value)
+
+    def observe_property(self, name, string=False):
+        """
+        Return an async context manager for observing a property. Iterating
+        it yields the current value, then the new value after each change (or
+        only the latest, if the consumer is slower than the changes). If
+        string is set, observe_property_string is used.
+        """
+        return _PropertyObserver(self, name, string)
+
+    def events(self):
+        """
+        Return an async context manager, which when iterated yields all events
+        (as dicts) received while it is active.
+        """
+        return _EventQueue(self, self._queue_size)
+
+    async def _read_loop(self):
+        error = None
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line)
+                if "event" in msg:
+                    await self._event(msg)
+                    continue
+                reply = self._pending.get(msg.get("request_id"))
+                if reply and not reply.done():
+                    reply.set_result(msg)
+        except (OSError, ValueError) as e:
+            error = e
+        self._writer.close()
+        self._error = ConnectionClosed("connection to mpv closed")
+        if error:
+            self._error.__cause__ = error
+        for reply in self._pending.values():
+            if not reply.done():
+                reply.set_exception(self._error)
+        for observer in self._observers.values():
+            observer._update(_closed)
+        for queue in self._event_queues:
+            queue._close()
+
+    async def _event(self, msg):
+        if msg["event"] == "property-change":
+            observer = self._observers.get(msg.get("id"))
+            if observer:
+                observer._update(msg.get("data"))
+        for queue in list(self._event_queues):
+            await queue._queue.put(msg)
+
+async def connect(path, **kwargs):
+    """
+    Connect to the IPC socket at path (as passed to --input-ipc-server) and
+    return a Client. Keyword arguments are passed to Client. Raises OSError
+    if the connection fails, e.g. ConnectionRefusedError if mpv is not
+    running anymore and FileNotFoundError if the socket doesn't exist.
+    """
+    # replies can be large (e.g. the playlist property)
+    reader, writer = await asyncio.open_unix_connection(path, limit=1 << 24)
+    return Client(reader, writer, **kwargs)
@@ -1,15 +1,14 @@
 #!/usr/bin/env python3
-from pyqtgraph.Qt import QtGui, QtCore
-import pyqtgraph as pg
+import numpy as np
+import argparse
+import os
 import sys
 import re
-
-filename = sys.argv[1]
-
-events = ".*"
-if len(sys.argv) > 2:
-    events = sys.argv[2]
-event_regex = re.compile(events)
+import json
+import math
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
 """
 This script is meant to display stats written by mpv --dump-stats=filename.
@@ -34,11 +33,44 @@ Currently, the following event types are supported:
     'range-timed' <ts1> <ts2> <name>        like start/end, but explicit times
     <name>                      singular event (same as 'signal')
 
+With --summary, no window is opened (and Qt is not needed). Instead, per-event
+statistics are printed: durations of start/end and range-timed pairs (in ms),
+distributions of values, and the number of singular events.
+
+With --compare BASELINE, the events of filename are compared against those of
+the BASELINE dump, e.g. to check a new build for frame timing regressions:
+
+    stats-conv.py new.txt --compare old.txt --threshold 'flip|render:p99:10'
+
+This exits with status 1 if the p99 of flip or render durations increased by
+more than 10%, and a Mann-Whitney U test says the change is significant.
+
+With --view, durations and values are plotted as computed views instead:
+the p50/p95/p99 of each --width seconds window, histograms over the whole
+capture, or heatmaps of the distribution in each --width seconds window. The
+percentile windows start every --step seconds, so with a step smaller than the
+width they are rolling windows (e.g. --width 10 --step 1).
+
+Passing an event regex or --from/--to makes the script skip the parsing of
+lines that are not needed (unless the dump is already cached). --from/--to
+select samples by their own timestamp, also for timed events (which can be
+written long after the time they refer to), so the result is the same whether
+or not the dump is cached.
+
+With --export-trace, the start/end intervals are written as Chrome Trace Event
+JSON, which can be loaded into Perfetto or chrome://tracing. Each '#' comment
+gets its own track.
+
+With --follow, the file is read while mpv is still writing it. The plots are
+updated periodically with newly appended events, and only the last --window
+seconds are kept.
+
 """
 
 class G:
     events = {}
     start = None
+    last = 0
     markers = ["o", "s", "t", "d"]
     curveno = {}
 
@@ -50,117 +82,971 @@ def find_marker():
     return m
 
 class Event:
-    pass
+    """
+    Samples of a single named event. Timestamps and values are kept in typed
+    arrays (8 bytes per item) instead of a list of tuples, so that the memory
+    needed for long captures stays proportional to the number of samples.
+    For 'event' type events, each sample is an edge: 1 for start, 0 for end.
+    """
+    def __init__(self, name, evtype):
+        self.name = name
+        self.type = evtype
+        self.marker = None
+        self.ts = array('d')
+        self.vals = array('d')
+
+    def add(self, ts, val):
+        self.ts.append(ts)
+        self.vals.append(val)
 
 def get_event(event, evtype):
     if event not in G.events:
-        e = Event()
-        e.name = event
-        e.vals = []
-        e.type = evtype
-        e.marker = "o"
-        if e.type == "event-signal":
-            e.marker = find_marker()
-        if not event_regex.match(e.name):
-            return e
-        G.events[event] = e
+        G.events[event] = Event(event, evtype)
     return G.events[event]
 
 colors = [(0.0, 0.5, 0.0), (0.0, 0.0, 1.0), (0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.75, 0.75, 0), (0.0, 0.75, 0.75), (0.75, 0, 0.75)]
-def mkColor(t):
-    return pg.mkColor(int(t[0] * 255), int(t[1] * 255), int(t[2] * 255))
 
 SCALE = 1e6 # microseconds to seconds
 
-for line in [line.split("#")[0].strip() for line in open(filename, "r")]:
-    line = line.strip()
+def parse_line(line):
+    line = line.split("#", 1)[0].strip()
     if not line:
-        continue
+        return
     ts, event = line.split(" ", 1)
     ts = int(ts) / SCALE
     if G.start is None:
         G.start = ts
     ts = ts - G.start
+    G.last = ts
     if event.startswith("start "):
         e = get_event(event[6:], "event")
-        e.vals.append((ts, 0))
-        e.vals.append((ts, 1))
+        e.add(ts, 1)
     elif event.startswith("end "):
         e = get_event(event[4:], "event")
-        e.vals.append((ts, 1))
-        e.vals.append((ts, 0))
+        e.add(ts, 0)
     elif event.startswith("value "):
         _, val, name = event.split(" ", 2)
         val = float(val)
         e = get_event(name, "value")
-        e.vals.append((ts, val))
+        e.add(ts, val)
     elif event.startswith("event-timed "):
         _, val, name = event.split(" ", 2)
         val = int(val) / SCALE - G.start
         e = get_event(name, "event-signal")
-        e.vals.append((val, 1))
+        e.add(val, 1)
     elif event.startswith("range-timed "):
         _, ts1, ts2, name = event.split(" ", 3)
         ts1 = int(ts1) / SCALE - G.start
         ts2 = int(ts2) / SCALE - G.start
         e = get_event(name, "event")
-        e.vals.append((ts1, 0))
-        e.vals.append((ts1, 1))
-        e.vals.append((ts2, 1))
-        e.vals.append((ts2, 0))
+        e.add(ts1, 1)
+        e.add(ts2, 0)
     elif event.startswith("value-timed "):
         _, tsval, val, name = event.split(" ", 3)
         tsval = int(tsval) / SCALE - G.start
         val = float(val)
         e = get_event(name, "value")
-        e.vals.append((tsval, val))
+        e.add(tsval, val)
     elif event.startswith("signal "):
         name = event.split(" ", 2)[1]
         e = get_event(name, "event-signal")
-        e.vals.append((ts, 1))
+        e.add(ts, 1)
     else:
         e = get_event(event, "event-signal")
-        e.vals.append((ts, 1))
-
-# deterministically sort them; make sure the legend is sorted too
-G.sevents = list(G.events.values())
-G.sevents.sort(key=lambda x: x.name)
-hasval = False
-for e, index in zip(G.sevents, range(len(G.sevents))):
-    m = len(G.sevents)
-    if e.type == "value":
-        hasval = True
-    else:
-        e.vals = [(x, y * (m - index) / m) for (x, y) in e.vals]
-
-pg.setConfigOption('background', 'w')
-pg.setConfigOption('foreground', 'k')
-app = QtGui.QApplication([])
-win = pg.GraphicsWindow()
-#win.resize(1500, 900)
-
-ax = [None, None]
-plots = 2 if hasval else 1
-ax[0] = win.addPlot()
-if hasval:
-    win.nextRow()
-    ax[1] = win.addPlot()
-    ax[1].setXLink(ax[0])
-for cur in ax:
-    if cur is not None:
+        e.add(ts, 1)
+
+def plot_data(e, scale):
+    """
+    Return the x/y arrays to plot for e. Start/end edges are expanded into a
+    square wave: each edge becomes two points, the level before and after it.
+    """
+    # copy, so that the event arrays can still grow (with --follow)
+    x = np.array(e.ts, dtype=np.float64)
+    y = np.array(e.vals, dtype=np.float64)
+    if e.type == "event":
+        x = np.repeat(x, 2)
+        y = np.repeat(y, 2)
+        y[0::2] = 1 - y[0::2]
+    # timed events can be out of order; decimation and clipping need sorted x
+    if len(x) > 1 and (np.diff(x) < 0).any():
+        order = np.argsort(x, kind="mergesort")
+        x, y = x[order], y[order]
+    return x, y * scale
+
+"""
+Parsed dumps are cached next to the dump file (<filename>.cache), so that
+reopening a large capture does not require parsing the text again. The cache
+is keyed by the size and mtime of the dump. Layout:
+
+    header      magic, dump size, dump mtime (ns), length of the JSON index
+    index       JSON: start timestamp and [name, type, count] for each event,
+                padded with spaces to a multiple of 8 bytes
+    data        for each event, count timestamps followed by count values,
+                as native float64
+
+The data is memory-mapped when loading, so only the samples that are actually
+used are read from disk.
+"""
+
+CACHE_MAGIC = b"MPVSTC01"
+CACHE_HEADER = struct.Struct("<8sQqQ")
+
+def cache_filename(filename):
+    return filename + ".cache"
+
+def load_cache(filename, st):
+    cachefile = cache_filename(filename)
+    try:
+        with open(cachefile, "rb") as f:
+            magic, size, mtime, length = CACHE_HEADER.unpack(f.read(CACHE_HEADER.size))
+            if magic != CACHE_MAGIC or (size, mtime) != (st.st_size, st.st_mtime_ns):
+                return False
+            index = json.loads(f.read(length))
+    except (OSError, ValueError, struct.error):
+        return False
+    total = sum(count for name, evtype, count in index["events"])
+    data = np.empty(0)
+    if total:
+        data = np.memmap(cachefile, dtype=np.float64, mode="r",
+                         offset=CACHE_HEADER.size + length)
+    if len(data) != 2 * total:
+        return False
+    G.start = index["start"]
+    pos = 0
+    for name, evtype, count in index["events"]:
+        e = get_event(name, evtype)
+        e.ts = data[pos:pos + count]
+        e.vals = data[pos + count:pos + 2 * count]
+        pos += 2 * count
+    return True
+
+def save_cache(filename, st):
+    index = {
+        "start": G.start,
+        "events": [[e.name, e.type, len(e.ts)] for e in G.events.values()],
+    }
+    index = json.dumps(index).encode("utf-8")
+    index += b" " * (-(CACHE_HEADER.size + len(index)) % 8)
+    cachefile = cache_filename(filename)
+    tmp = cachefile + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, st.st_size, st.st_mtime_ns, len(index)))
+            f.write(index)
+            for e in G.events.values():
+                e.ts.tofile(f)
+                e.vals.tofile(f)
+        os.replace(tmp, cachefile)
+    except OSError as ex:
+        print("Could not write cache %s: %s" % (cachefile, ex), file=sys.stderr)
+
+# number of space separated fields before the event name, per event type
+name_fields = {b"start": 1, b"end": 1, b"signal": 1, b"value": 2,
+               b"event-timed": 2, b"value-timed": 3, b"range-timed": 3}
+
+def event_name(event):
+    """
+    Return the name in the text of an event (bytes, without the timestamp),
+    without converting any of the numbers in it.
+    """
+    n = name_fields.get(event.split(b" ", 1)[0])
+    if n is None:
+        return event
+    fields = event.split(b" ", n)
+    if len(fields) <= n:
+        return event
+    if n == 1 and event.startswith(b"signal "):
+        return fields[1].split(b" ", 1)[0]
+    return fields[n]
+
+def regex_literals(event_regex):
+    """
+    If event_regex is a plain alternation of names, return them as bytes. Any
+    line matching the regex must contain one of them.
+    """
+    if re.fullmatch(r"[\w\-]+(\|[\w\-]+)*", event_regex.pattern):
+        return [l.encode("utf-8") for l in event_regex.pattern.split("|")]
+    return None
+
+def first_timestamp(f):
+    """
+    Return the timestamp (in seconds) of the first event in f (opened in
+    binary mode), and rewind f.
+    """
+    ts = None
+    for line in f:
+        text = line.split(b"#", 1)[0].strip()
+        if text:
+            ts = int(text.split(b" ", 1)[0]) / SCALE
+            break
+    f.seek(0)
+    return ts
+
+# timed events carry their own timestamps, which can be before or after the
+# timestamp of the line
+timed_types = (b"event-timed ", b"value-timed ", b"range-timed ")
+
+def parse_filtered(f, event_regex, start, end):
+    """
+    Parse the lines of f (opened in binary mode) whose event name matches
+    event_regex, and keep the samples whose timestamp (in seconds relative to
+    the first line) is within [start, end]. Each is None if not restricted.
+    The cheap checks are done first: if the regex is just a list of names,
+    lines not containing any of them are skipped right away (others may still
+    be parsed, and are dropped later). Otherwise the regex is matched against
+    the name (cached per name). Lines of untimed events outside of the time
+    range are skipped before converting any numbers; timed events are always
+    parsed, and their samples clipped afterwards, like with a cached dump.
+    """
+    # times are relative to the first line, even if it's filtered out
+    G.start = first_timestamp(f)
+    literals = event_regex and regex_literals(event_regex)
+    if literals:
+        literals = re.compile(b"|".join(re.escape(l) for l in literals)).search
+    check_names = event_regex and not literals
+    check_time = start is not None or end is not None
+    names = {}
+    for line in f:
+        if literals and not literals(line):
+            continue
+        if check_names or check_time:
+            text = line.split(b"#", 1)[0].strip()
+            if not text:
+                continue
+            ts, _, event = text.partition(b" ")
+            if check_names:
+                name = event_name(event)
+                match = names.get(name)
+                if match is None:
+                    name_str = name.decode("utf-8", "replace")
+                    match = names[name] = bool(event_regex.match(name_str))
+                if not match:
+                    continue
+            if check_time and not event.startswith(timed_types):
+                ts = int(ts) / SCALE - G.start
+                if end is not None and ts > end:
+                    continue
+                if start is not None and ts < start:
+                    continue
+        parse_line(line.decode("utf-8", "replace"))
+    if check_time:
+        clip_events(start, end)
+
+def clip_events(start, end):
+    """
+    Drop the samples outside of [start, end] (either can be None), and the
+    events that have none left.
+    """
+    for e in list(G.events.values()):
+        ts = np.frombuffer(e.ts, dtype=np.float64)
+        keep = np.ones(len(ts), dtype=bool)
+        if start is not None:
+            keep &= ts >= start
+        if end is not None:
+            keep &= ts <= end
+        if not keep.any():
+            del G.events[e.name]
+            continue
+        e.ts = ts[keep]
+        e.vals = np.frombuffer(e.vals, dtype=np.float64)[keep]
+
+# size of the blocks read by parse_chunk()
+CHUNK_READ = 16 * 1024 * 1024
+# files smaller than this are not worth starting processes for
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+
+def parse_chunk(filename, start, begin, end):
+    """
+    Parse the lines in the byte range [begin, end) of filename (both at line
+    starts). start is the timestamp of the first line of the file. Runs in a
+    worker process; returns (name, type, timestamps, values) for each event,
+    in the order they first appear.
+    """
+    G.events = {}
+    G.start = start
+    with open(filename, "rb") as f:
+        f.seek(begin)
+        pending = b""
+        while begin < end:
+            data = f.read(min(CHUNK_READ, end - begin))
+            if not data:
+                break
+            begin += len(data)
+            data = pending + data
+            cut = data.rfind(b"\n") + 1
+            pending = data[cut:]
+            for line in data[:cut].decode("utf-8", "replace").split("\n"):
+                parse_line(line)
+        parse_line(pending.decode("utf-8", "replace"))
+    return [(e.name, e.type, e.ts, e.vals) for e in G.events.values()]
+
+def read_parallel(filename, size, jobs):
+    """
+    Parse filename with jobs processes, each parsing a part of the file.
+    Since the parts are merged in file order, and start/end edges are stored
+    separately, the result is the same as when parsing it sequentially; a
+    pair crossing a part boundary ends up adjacent again after merging.
+    """
+    with open(filename, "rb") as f:
+        G.start = first_timestamp(f)
+        bounds = [0]
+        for n in range(1, jobs):
+            f.seek(max(size * n // jobs - 1, bounds[-1]))
+            f.readline()
+            bounds.append(max(f.tell(), bounds[-1]))
+        bounds.append(size)
+    with ProcessPoolExecutor(jobs) as executor:
+        parts = [executor.submit(parse_chunk, filename, G.start, begin, end)
+                 for begin, end in zip(bounds[:-1], bounds[1:])]
+        for part in parts:
+            for name, evtype, ts, vals in part.result():
+                e = get_event(name, evtype)
+                e.ts.extend(ts)
+                e.vals.extend(vals)
+
+def read_stats(filename, event_regex=None, start=None, end=None, jobs=1):
+    """
+    Read filename into G.events. If event_regex, start or end is set, events
+    that don't match or are outside of the time range may be left out. If
+    jobs is larger than 1, a large file is parsed with that many processes.
+    """
+    G.events = {}
+    G.start = None
+    st = os.stat(filename)
+    if load_cache(filename, st):
+        if start is not None or end is not None:
+            clip_events(start, end)
+        return G.events
+    if event_regex and event_regex.pattern in ("", ".*"):
+        event_regex = None
+    if event_regex or start is not None or end is not None:
+        # the result is incomplete, so it's not cached
+        with open(filename, "rb") as f:
+            parse_filtered(f, event_regex, start, end)
+        return G.events
+    if jobs > 1 and st.st_size >= PARALLEL_MIN_SIZE:
+        read_parallel(filename, st.st_size, jobs)
+        save_cache(filename, st)
+        return G.events
+    # read the file incrementally; only the per-event sample arrays are kept
+    with open(filename, "r") as f:
+        for line in f:
+            parse_line(line)
+    save_cache(filename, st)
+    return G.events
+
+def durations(e):
+    """
+    Return the start times and the durations (in seconds) of an 'event' type
+    event. A duration is a start edge directly followed by an end edge;
+    unpaired edges (e.g. at the start or end of the capture) are ignored.
+    """
+    ts = np.frombuffer(e.ts, dtype=np.float64)
+    vals = np.frombuffer(e.vals, dtype=np.float64)
+    pairs = np.flatnonzero((vals[:-1] == 1) & (vals[1:] == 0))
+    # The dump has microsecond timestamps; round away the float error from
+    # making them relative, so that equal durations compare equal (ties
+    # matter for mann_whitney()).
+    d = np.round((ts[pairs + 1] - ts[pairs]) * SCALE) / SCALE
+    return ts[pairs], d
+
+def timed_samples(e):
+    """
+    Return the kind of samples e has ("duration", "value" or "signal") and,
+    except for signals, the timestamps and the samples. Durations are in
+    milliseconds, and their timestamp is the start.
+    """
+    if e.type == "event":
+        ts, d = durations(e)
+        return "duration", ts, d * 1e3
+    elif e.type == "value":
+        return ("value", np.frombuffer(e.ts, dtype=np.float64),
+                np.frombuffer(e.vals, dtype=np.float64))
+    return "signal", None, None
+
+def samples(e):
+    """
+    Like timed_samples(), without the timestamps.
+    """
+    kind, ts, data = timed_samples(e)
+    return kind, data
+
+def summarize(e):
+    """
+    Return a dict with statistics for e.
+    """
+    kind, data = samples(e)
+    res = {"type": kind}
+    if data is None:
+        res["count"] = len(e.ts)
+        return res
+    res["count"] = len(data)
+    if len(data):
+        p50, p95, p99 = np.percentile(data, [50, 95, 99])
+        res.update({
+            "total": float(data.sum()),
+            "min": float(data.min()),
+            "mean": float(data.mean()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": float(data.max()),
+        })
+    return res
+
+summary_columns = ["count", "total", "min", "mean", "p50", "p95", "p99", "max"]
+
+def print_summary(sevents, as_json):
+    summary = {e.name: summarize(e) for e in sevents}
+    if as_json:
+        json.dump(summary, sys.stdout, indent=4)
+        print()
+        return
+    width = max([len(name) for name in summary] + [5])
+    print("%-*s %-12s" % (width, "event", "type") +
+          "".join("%12s" % c for c in summary_columns))
+    for name, res in summary.items():
+        line = "%-*s %-12s" % (width, name, res["type"])
+        for c in summary_columns:
+            val = res.get(c)
+            if val is None:
+                line += "%12s" % "-"
+            elif c == "count":
+                line += "%12d" % val
+            else:
+                line += "%12.3f" % val
+        print(line)
+
+def mann_whitney(x, y):
+    """
+    Two-sided Mann-Whitney U test, using the normal approximation with tie
+    correction (fine for the sample sizes in stats dumps). Returns the p-value
+    for the hypothesis that x and y come from the same distribution, or None
+    if there are not enough samples.
+    """
+    n1, n2 = len(x), len(y)
+    n = n1 + n2
+    if n1 < 2 or n2 < 2:
+        return None
+    data = np.concatenate((x, y))
+    sorter = np.argsort(data, kind="mergesort")
+    data = data[sorter]
+    # average ranks for ties
+    first = np.flatnonzero(np.r_[True, data[1:] != data[:-1]])
+    bounds = np.r_[first, n]
+    group = np.cumsum(np.r_[True, data[1:] != data[:-1]]) - 1
+    ranks = np.empty(n)
+    ranks[sorter] = 0.5 * (bounds[group] + bounds[group + 1] + 1)
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    ties = np.diff(bounds).astype(np.float64)
+    var = n1 * n2 / 12 * ((n + 1) - (ties ** 3 - ties).sum() / (n * (n - 1)))
+    if var <= 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(var)
+    return math.erfc(max(z, 0) / math.sqrt(2))
+
+compare_columns = ["mean", "p50", "p95", "p99", "max"]
+
+def parse_threshold(spec):
+    """
+    Parse a threshold of the form EVENT:STAT:PERCENT, where EVENT is a regex
+    matching event names and STAT is one of compare_columns.
+    """
+    try:
+        events, stat, limit = spec.rsplit(":", 2)
+        limit = float(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected EVENT:STAT:PERCENT")
+    if stat not in compare_columns:
+        raise argparse.ArgumentTypeError("STAT must be one of " +
+                                         ", ".join(compare_columns))
+    return re.compile(events), stat, limit
+
+def compare(base, cand, thresholds, alpha):
+    """
+    Compare the events in cand against base (both lists of Event). Returns a
+    dict with the per-event results and a list of threshold violations. A
+    threshold is only considered exceeded if the change is also significant.
+    """
+    base = {e.name: e for e in base}
+    result = {"events": {}, "regressions": []}
+    for e in cand:
+        if e.name not in base:
+            continue
+        kind, new = samples(e)
+        old = samples(base[e.name])[1]
+        if new is None or old is None:
+            continue
+        res = {
+            "type": kind,
+            "baseline": summarize(base[e.name]),
+            "candidate": summarize(e),
+            "change": {},
+            "p": mann_whitney(old, new),
+        }
+        for c in compare_columns:
+            a = res["baseline"].get(c)
+            b = res["candidate"].get(c)
+            if a is not None and b is not None and a != 0:
+                res["change"][c] = (b - a) / abs(a) * 100
+        for regex, stat, limit in thresholds:
+            change = res["change"].get(stat)
+            if not regex.match(e.name) or change is None or change <= limit:
+                continue
+            if res["p"] is not None and res["p"] < alpha:
+                result["regressions"].append({
+                    "event": e.name,
+                    "stat": stat,
+                    "baseline": res["baseline"][stat],
+                    "candidate": res["candidate"][stat],
+                    "change": change,
+                    "limit": limit,
+                    "p": res["p"],
+                })
+        result["events"][e.name] = res
+    return result
+
+def print_compare(result, as_json):
+    if as_json:
+        json.dump(result, sys.stdout, indent=4)
+        print()
+        return
+    events = result["events"]
+    width = max([len(name) for name in events] + [5])
+    print("%-*s %-9s%10s%10s" % (width, "event", "type", "n(base)", "n(cand)") +
+          "".join("%10s" % c for c in compare_columns) + "%10s" % "p")
+    for name, res in events.items():
+        line = "%-*s %-9s%10d%10d" % (width, name, res["type"],
+                                      res["baseline"]["count"],
+                                      res["candidate"]["count"])
+        for c in compare_columns:
+            change = res["change"].get(c)
+            line += "%10s" % ("-" if change is None else "%+.1f%%" % change)
+        line += "%10s" % ("-" if res["p"] is None else "%.3g" % res["p"])
+        print(line)
+    for r in result["regressions"]:
+        print("REGRESSION: %s %s %.3f -> %.3f (%+.1f%% > %g%%, p=%.3g)" %
+              (r["event"], r["stat"], r["baseline"], r["candidate"],
+               r["change"], r["limit"], r["p"]))
+
+def read_tracks(filename):
+    """
+    Parse filename like read_stats(), but keep the events of each '#' comment
+    (the log prefix of the component that wrote the line) separate. Returns a
+    dict mapping the comment to a dict of events.
+    """
+    tracks = {}
+    G.start = None
+    with open(filename, "r") as f:
+        for line in f:
+            text, _, tag = line.partition("#")
+            if not text.strip():
+                continue
+            G.events = tracks.setdefault(tag.strip() or "mpv", {})
+            parse_line(line)
+    return tracks
+
+def trace_events(tracks, event_regex):
+    """
+    Yield Chrome Trace Event Format events for tracks (as returned by
+    read_tracks()). Each track becomes a thread. Start/end edges are paired
+    up per event name with a stack, so nested intervals of the same name are
+    preserved; unpaired edges are dropped. Singular events become instant
+    events, values become counters.
+    """
+    us = lambda ts: round(ts * SCALE, 3)
+    yield {"name": "process_name", "ph": "M", "pid": 1,
+           "args": {"name": "mpv"}}
+    for tid, (tag, events) in enumerate(tracks.items(), 1):
+        yield {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+               "args": {"name": tag}}
+        for e in events.values():
+            if not event_regex.match(e.name):
+                continue
+            base = {"name": e.name, "cat": tag, "pid": 1, "tid": tid}
+            if e.type == "event":
+                stack = []
+                for ts, val in zip(e.ts, e.vals):
+                    if val:
+                        stack.append(ts)
+                    elif stack:
+                        start = stack.pop()
+                        yield dict(base, ph="X", ts=us(start),
+                                   dur=us(ts - start))
+            elif e.type == "value":
+                for ts, val in zip(e.ts, e.vals):
+                    yield dict(base, ph="C", ts=us(ts), args={e.name: val})
+            else:
+                for ts in e.ts:
+                    yield dict(base, ph="i", s="t", ts=us(ts))
+
+def export_trace(filename, out, event_regex):
+    """
+    Write filename as Chrome Trace Event Format JSON to out, which can be
+    loaded into chrome://tracing or https://ui.perfetto.dev.
+    """
+    tracks = read_tracks(filename)
+    out.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+    sep = ""
+    for ev in trace_events(tracks, event_regex):
+        out.write(sep + json.dumps(ev))
+        sep = ",\n"
+    out.write("\n]}\n")
+
+class Follower:
+    """
+    Reads a stats file that is still being written. Each poll() parses only
+    the lines appended since the previous call, and drops all samples older
+    than the last window seconds.
+    """
+    def __init__(self, filename, window):
+        self.f = open(filename, "rb")
+        self.window = window
+        self.pending = b""
+
+    def poll(self):
+        """
+        Parse new lines; return whether there were any.
+        """
+        if os.fstat(self.f.fileno()).st_size < self.f.tell():
+            # truncated, e.g. because mpv was restarted
+            self.f.seek(0)
+            self.pending = b""
+            G.start = None
+            for e in G.events.values():
+                del e.ts[:]
+                del e.vals[:]
+        added = 0
+        while True:
+            line = self.f.readline()
+            if not line:
+                break
+            if not line.endswith(b"\n"):
+                self.pending += line
+                break
+            parse_line((self.pending + line).decode("utf-8", "replace"))
+            self.pending = b""
+            added += 1
+            # don't accumulate the entire file on the first poll
+            if added % 100000 == 0:
+                self.trim()
+        if added:
+            self.trim()
+        return added > 0
+
+    def trim(self):
+        # Timed events are added with their own timestamps, so the arrays
+        # aren't necessarily sorted, and every sample has to be checked.
+        cutoff = G.last - self.window
+        for e in G.events.values():
+            ts = np.frombuffer(e.ts, dtype=np.float64)
+            keep = ts >= cutoff
+            if keep.all():
+                continue
+            vals = np.frombuffer(e.vals, dtype=np.float64)
+            e.ts = array('d', ts[keep].tobytes())
+            e.vals = array('d', vals[keep].tobytes())
+
+def plot(get_events, poll=None, interval=500):
+    """
+    Show the events returned by get_events(). If poll is set, it is called
+    every interval ms, and the plots are updated if it returns True.
+    """
+    from pyqtgraph.Qt import QtGui, QtCore
+    import pyqtgraph as pg
+
+    pg.setConfigOption('background', 'w')
+    pg.setConfigOption('foreground', 'k')
+    app = QtGui.QApplication([])
+    win = pg.GraphicsWindow()
+    #win.resize(1500, 900)
+
+    ax = [None, None]
+    curves = {}
+
+    def add_plot(index):
+        if index:
+            win.nextRow()
+        cur = ax[index] = win.addPlot()
+        if index:
+            cur.setXLink(ax[0])
         cur.addLegend(offset = (-1, 1))
-for e in G.sevents:
-    cur = ax[1 if e.type == "value" else 0]
-    if not cur in G.curveno:
-        G.curveno[cur] = 0
-    args = {'name': e.name,'antialias':True}
-    color = mkColor(colors[G.curveno[cur] % len(colors)])
-    if e.type == "event-signal":
-        args['symbol'] = e.marker
-        args['symbolBrush'] = pg.mkBrush(color, width=0)
+        # Only draw the visible part of each curve, reduced to the min and
+        # max of each group of points falling into one pixel column. This
+        # is redone whenever the view range changes, so zooming in shows
+        # the full detail, and spikes stay visible when zoomed out.
+        cur.setClipToView(True)
+        cur.setDownsampling(auto=True, mode='peak')
+
+    def update():
+        sevents = get_events()
+        if ax[1] is None and any(e.type == "value" for e in sevents):
+            add_plot(1)
+        m = len(sevents)
+        for e, index in zip(sevents, range(m)):
+            scale = 1 if e.type == "value" else (m - index) / m
+            if e.name in curves:
+                curves[e.name].setData(*plot_data(e, scale))
+                continue
+            cur = ax[1 if e.type == "value" else 0]
+            if not cur in G.curveno:
+                G.curveno[cur] = 0
+            args = {'name': e.name,'antialias':True}
+            t = colors[G.curveno[cur] % len(colors)]
+            color = pg.mkColor(int(t[0] * 255), int(t[1] * 255), int(t[2] * 255))
+            if e.type == "event-signal":
+                args['symbol'] = e.marker
+                args['symbolBrush'] = pg.mkBrush(color, width=0)
+            else:
+                args['pen'] = pg.mkPen(color, width=0)
+            G.curveno[cur] += 1
+            curves[e.name] = cur.plot(*plot_data(e, scale), **args)
+
+    def timeout():
+        if poll():
+            update()
+
+    add_plot(0)
+    update()
+    if poll:
+        timer = QtCore.QTimer()
+        timer.timeout.connect(timeout)
+        timer.start(interval)
+
+    QtGui.QApplication.instance().exec_()
+
+def windowed_percentiles(ts, data, width, qs, step=None):
+    """
+    Split the samples into windows of width seconds (by their timestamps ts),
+    starting every step seconds (by default width, so that they don't
+    overlap), and return the start of each non-empty window, and for each q
+    in qs, the q-th percentile (nearest rank) of the samples in each window.
+    """
+    if not len(data):
+        return np.empty(0), [np.empty(0) for q in qs]
+    step = step or width
+    # A sample is in ceil(width / step) windows at most; put a copy into each,
+    # and sort all windows at once.
+    last = np.floor(ts / step).astype(np.int64)
+    bins, copies = [], []
+    for n in range(int(np.ceil(width / step))):
+        inside = (last - n) * step + width > ts
+        bins.append(last[inside] - n)
+        copies.append(data[inside])
+    bins, data = np.concatenate(bins), np.concatenate(copies)
+    order = np.lexsort((data, bins))
+    bins, data = bins[order], data[order]
+    first = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    counts = np.diff(np.r_[first, len(bins)])
+    res = []
+    for q in qs:
+        rank = np.floor(q / 100 * (counts - 1) + 0.5).astype(np.int64)
+        res.append(data[first + rank])
+    return bins[first] * step, res
+
+def heatmap(ts, data, width, bins):
+    """
+    Return a 2D histogram of the samples: columns are windows of width
+    seconds, rows are bins of the sample values. The rows start at 0, or at
+    the 0.1th percentile if there are negative values (e.g. A/V sync deltas).
+    Values above the 99.9th percentile (or below the 0.1th) are put into the
+    top (or bottom) row, so single outliers don't squash the rest of the
+    distribution. Also returns the (x, y, w, h) covered.
+    """
+    bottom, top = np.percentile(data, [0.1, 99.9])
+    bottom = min(bottom, 0)
+    if top <= bottom:
+        top = max(data.max(), bottom + 1)
+    x0 = np.floor(ts.min() / width) * width
+    ncols = max(int(np.ceil((ts.max() - x0) / width)), 1)
+    hist, _, _ = np.histogram2d(ts, np.clip(data, bottom, top),
+                                bins=[ncols, bins],
+                                range=[[x0, x0 + ncols * width], [bottom, top]])
+    return hist, (x0, bottom, ncols * width, top - bottom)
+
+view_percentiles = [(50, None), (95, "dash"), (99, "dot")]
+
+def plot_view(sevents, view, width, bins, step=None):
+    """
+    Show computed views of the durations and values of sevents: "percentiles"
+    plots the p50/p95/p99 of each window of width seconds (starting every step
+    seconds), "histogram" the
+    distribution over the whole capture, and "heatmap" the distribution
+    (in bins rows) of each window.
+    """
+    from pyqtgraph.Qt import QtGui, QtCore
+    import pyqtgraph as pg
+
+    pg.setConfigOption('background', 'w')
+    pg.setConfigOption('foreground', 'k')
+    app = QtGui.QApplication([])
+    win = pg.GraphicsWindow()
+
+    series = []
+    for e in sevents:
+        kind, ts, data = timed_samples(e)
+        if data is not None and len(data):
+            series.append((e.name, kind, ts, data))
+
+    styles = {None: QtCore.Qt.SolidLine, "dash": QtCore.Qt.DashLine,
+              "dot": QtCore.Qt.DotLine}
+    ax = {}
+    def get_plot(kind, title=None):
+        key = title or kind
+        if key not in ax:
+            if ax:
+                win.nextRow()
+            cur = ax[key] = win.addPlot(title=title)
+            cur.setLabel('left', kind + (" (ms)" if kind == "duration" else ""))
+            if view == "histogram":
+                cur.setLabel('bottom', kind + (" (ms)" if kind == "duration" else ""))
+            else:
+                first = next(iter(ax.values()))
+                if first is not cur:
+                    cur.setXLink(first)
+            if view != "heatmap":
+                cur.addLegend(offset = (-1, 1))
+        return ax[key]
+
+    for (name, kind, ts, data), n in zip(series, range(len(series))):
+        t = colors[n % len(colors)]
+        color = pg.mkColor(int(t[0] * 255), int(t[1] * 255), int(t[2] * 255))
+        if view == "percentiles":
+            cur = get_plot(kind)
+            x, ys = windowed_percentiles(ts, data, width,
+                                         [q for q, style in view_percentiles],
+                                         step)
+            for (q, style), y in zip(view_percentiles, ys):
+                pen = pg.mkPen(color, width=0, style=styles[style])
+                cur.plot(x, y, pen=pen, name="%s p%d" % (name, q))
+        elif view == "histogram":
+            cur = get_plot(kind)
+            y, x = np.histogram(data, bins=bins)
+            cur.plot(x, y, stepMode=True, pen=pg.mkPen(color, width=0),
+                     name=name)
+        elif view == "heatmap":
+            cur = get_plot(kind, name)
+            hist, rect = heatmap(ts, data, width, bins)
+            img = pg.ImageItem(np.log1p(hist))
+            img.setRect(QtCore.QRectF(*rect))
+            img.setLookupTable([(255 - i, 255 - i, 255 - i) for i in range(256)])
+            cur.addItem(img)
+
+    QtGui.QApplication.instance().exec_()
+
+def select_events(event_regex):
+    # the cache contains all events; filter them only now
+    sevents = [e for e in G.events.values() if event_regex.match(e.name)]
+    for e in sevents:
+        if e.type == "event-signal" and e.marker is None:
+            e.marker = find_marker()
+    # deterministically sort them; make sure the legend is sorted too
+    sevents.sort(key=lambda x: x.name)
+    return sevents
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Display stats written by mpv --dump-stats=filename.")
+    parser.add_argument("filename", help="stats file written by --dump-stats")
+    parser.add_argument("events", nargs="?", default=".*",
+                        help="regex matching the names of the events to use")
+    parser.add_argument("--from", dest="start", type=float, metavar="SECONDS",
+                        help="ignore events before this time (relative to "
+                             "the first line)")
+    parser.add_argument("--to", dest="end", type=float, metavar="SECONDS",
+                        help="ignore events after this time")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes for parsing large files "
+                             "(default: %(default)s)")
+    parser.add_argument("--summary", action="store_true",
+                        help="print per-event statistics instead of plotting")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="compare filename (the candidate) against the "
+                             "BASELINE stats file")
+    parser.add_argument("--threshold", metavar="EVENT:STAT:PERCENT",
+                        type=parse_threshold, action="append", default=[],
+                        help="with --compare, exit with status 1 if STAT "
+                             "(one of %s) of events matching the EVENT regex "
+                             "increases by more than PERCENT, and the change "
+                             "is significant (can be given multiple times)"
+                             % ", ".join(compare_columns))
+    parser.add_argument("--alpha", type=float, default=0.05,
+                        help="significance level for --threshold "
+                             "(Mann-Whitney U test, default: %(default)s)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the --summary or --compare output as JSON")
+    parser.add_argument("--export-trace", metavar="OUTFILE",
+                        help="write the events as Chrome Trace Event JSON "
+                             "(for Perfetto), with one track per '#' comment; "
+                             "'-' writes to stdout")
+    parser.add_argument("--follow", action="store_true",
+                        help="keep reading the file while it is being "
+                             "written, and update the plots")
+    parser.add_argument("--window", type=float, default=60,
+                        help="with --follow, number of seconds to keep "
+                             "(default: %(default)s)")
+    parser.add_argument("--view", default="raw",
+                        choices=["raw", "percentiles", "histogram", "heatmap"],
+                        help="what to plot: the raw events (default), "
+                             "p50/p95/p99 per time window, histograms, or "
+                             "heatmaps of the distribution over time")
+    parser.add_argument("--width", type=float, default=1.0,
+                        help="time window in seconds for --view percentiles "
+                             "and heatmap (default: %(default)s)")
+    parser.add_argument("--step", type=float,
+                        help="start a --view percentiles window every STEP "
+                             "seconds; smaller than --width for rolling "
+                             "windows (default: --width)")
+    parser.add_argument("--bins", type=int, default=100,
+                        help="number of bins for --view histogram and "
+                             "heatmap (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.follow and (args.summary or args.compare or args.export_trace
+                        or args.view != "raw"):
+        parser.error("--follow can only be used for plotting")
+    if args.step is not None and not 0 < args.step <= args.width:
+        parser.error("--step must be positive and at most --width")
+
+    event_regex = re.compile(args.events)
+
+    if args.compare:
+        base = read_stats(args.compare, event_regex, args.start, args.end,
+                          args.jobs)
+        base = [e for e in base.values() if event_regex.match(e.name)]
+        cand = read_stats(args.filename, event_regex, args.start, args.end,
+                          args.jobs)
+        cand = [e for e in cand.values() if event_regex.match(e.name)]
+        cand.sort(key=lambda x: x.name)
+        result = compare(base, cand, args.threshold, args.alpha)
+        print_compare(result, args.json)
+        sys.exit(1 if result["regressions"] else 0)
+
+    if args.export_trace:
+        if args.export_trace == "-":
+            export_trace(args.filename, sys.stdout, event_regex)
+        else:
+            with open(args.export_trace, "w") as f:
+                export_trace(args.filename, f, event_regex)
+        return
+
+    get_events = lambda: select_events(event_regex)
+
+    if args.follow:
+        # the file is still changing, so the cache is not used
+        follower = Follower(args.filename, args.window)
+        follower.poll()
+        plot(get_events, follower.poll)
+        return
+
+    read_stats(args.filename, event_regex, args.start, args.end, args.jobs)
+
+    if args.summary:
+        print_summary(get_events(), args.json)
+    elif args.view != "raw":
+        plot_view(get_events(), args.view, args.width, args.bins, args.step)
     else:
-        args['pen'] = pg.mkPen(color, width=0)
-    G.curveno[cur] += 1
-    n = cur.plot([x for x,y in e.vals], [y for x,y in e.vals], **args)
+        plot(get_events)
 
-QtGui.QApplication.instance().exec_()
+if __name__ == "__main__":
+    main()
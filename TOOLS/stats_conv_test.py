@@ -0,0 +1,319 @@
+"""
+Tests for stats-conv.py. Run with:
+
+    python3 TOOLS/stats_conv_test.py
+
+or with "meson test" in a build configured with -Dtests=true. NumPy is
+required, like for the script; without it, the tests are skipped.
+"""
+
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    print("NumPy is not installed, skipping")
+    sys.exit(77) # "skipped" for meson test
+
+def load_module():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "stats-conv.py")
+    spec = importlib.util.spec_from_file_location("stats_conv", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["stats_conv"] = module
+    spec.loader.exec_module(module)
+    return module
+
+sc = load_module()
+
+def write_dump(path, start, durations, seed):
+    rnd = random.Random(seed)
+    with open(path, "w") as f:
+        t = start
+        for d in durations:
+            t += rnd.randint(10000, 20000)
+            f.write("%d start render #vo\n%d end render #vo\n" % (t, t + d))
+
+class SummaryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "stats.txt")
+        write_mixed(self.path, 100)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_summary(self):
+        sc.read_stats(self.path)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            sc.print_summary(sc.G.events.values(), True)
+        summary = json.loads(out.getvalue())
+        render = summary["render"]
+        self.assertEqual(render["type"], "duration")
+        self.assertEqual(render["count"], 100)
+        self.assertAlmostEqual(render["p99"], 5.0)
+        self.assertAlmostEqual(summary["decode"]["mean"], 15.0)
+        volume = summary["volume"]
+        self.assertEqual((volume["min"], volume["max"]), (0, 99))
+        self.assertAlmostEqual(volume["p50"], 49.5)
+        self.assertEqual(summary["frame-drop"], {"type": "signal",
+                                                 "count": 100})
+
+    def test_table(self):
+        sc.read_stats(self.path)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            sc.print_summary(sc.G.events.values(), False)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split(), ["event", "type"] +
+                         sc.summary_columns)
+        rows = {l.split()[0]: l.split()[1:] for l in lines[1:]}
+        self.assertEqual(rows["frame-drop"], ["signal", "100"] + ["-"] * 7)
+        self.assertEqual(rows["render"][:3], ["duration", "100", "500.000"])
+
+class CompareTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read(self, name, start, durations, seed):
+        path = os.path.join(self.tmpdir.name, name)
+        write_dump(path, start, durations, seed)
+        return list(sc.read_stats(path).values())
+
+    def test_identical_durations(self):
+        # Same durations at different (large) absolute timestamps must give
+        # exact ties, not float noise.
+        base = self.read("base.txt", 1700000000123457, [5000] * 2000, 1)
+        cand = self.read("cand.txt", 1712345678987651, [5000] * 2000, 2)
+        result = sc.compare(base, cand, [sc.parse_threshold("render:p50:1")],
+                            0.05)
+        self.assertAlmostEqual(result["events"]["render"]["p"], 1.0)
+        self.assertEqual(result["regressions"], [])
+
+    def test_same_distribution(self):
+        durations = [random.Random(3).randint(4000, 6000) for n in range(2000)]
+        base = self.read("base.txt", 1700000000123457, durations, 1)
+        cand = self.read("cand.txt", 1712345678987651, durations[::-1], 2)
+        p = sc.compare(base, cand, [], 0.05)["events"]["render"]["p"]
+        self.assertAlmostEqual(p, 1.0, places=2)
+
+    def test_regression(self):
+        base = self.read("base.txt", 1700000000123457, [5000] * 500, 1)
+        cand = self.read("cand.txt", 1712345678987651, [6000] * 500, 2)
+        result = sc.compare(base, cand, [sc.parse_threshold("render:p50:10")],
+                            0.05)
+        self.assertLess(result["events"]["render"]["p"], 1e-6)
+        self.assertEqual(len(result["regressions"]), 1)
+
+def write_mixed(path, count):
+    """
+    Write a dump with one second of each kind of event per line group.
+    """
+    with open(path, "w") as f:
+        start = 1700000000000000
+        for n in range(count):
+            t = start + n * 1000000
+            f.write("%d start render #vo\n%d end render #vo\n"
+                    % (t, t + 5000))
+            f.write("%d value %d volume\n" % (t, n))
+            # written 3 s after the time it refers to
+            f.write("%d value-timed %d %d delay\n" % (t, t - 3000000, n))
+            # refers to a time 2 s later
+            f.write("%d event-timed %d vsync\n" % (t, t + 2000000))
+            f.write("%d range-timed %d %d decode\n" % (t, t - 20000, t - 5000))
+            f.write("%d signal frame-drop\n" % t)
+
+def snapshot():
+    return {name: (list(e.ts), list(e.vals)) for name, e in sc.G.events.items()}
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "stats.txt")
+        write_mixed(self.path, 100)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        sc.read_stats(self.path)
+        parsed, start = snapshot(), sc.G.start
+        self.assertEqual(len(parsed), 6)
+        sc.G.events = {}
+        sc.G.start = None
+        self.assertTrue(sc.load_cache(self.path, os.stat(self.path)))
+        self.assertEqual(snapshot(), parsed)
+        self.assertEqual(sc.G.start, start)
+        self.assertEqual({e.type for e in sc.G.events.values()},
+                         {"event", "value", "event-signal"})
+
+    def test_stale(self):
+        sc.read_stats(self.path)
+        with open(self.path, "a") as f:
+            f.write("1700000100000000 value 7 volume\n")
+        sc.G.events = {}
+        self.assertFalse(sc.load_cache(self.path, os.stat(self.path)))
+        sc.read_stats(self.path)
+        self.assertEqual(list(sc.G.events["volume"].vals)[-1], 7)
+
+class ParallelTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "stats.txt")
+        min_size = sc.PARALLEL_MIN_SIZE
+        sc.PARALLEL_MIN_SIZE = 0
+        self.addCleanup(setattr, sc, "PARALLEL_MIN_SIZE", min_size)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read(self, jobs):
+        try:
+            os.unlink(sc.cache_filename(self.path))
+        except FileNotFoundError:
+            pass
+        sc.read_stats(self.path, jobs=jobs)
+        return snapshot(), sc.G.start
+
+    def test_same_as_sequential(self):
+        # many part boundaries, some between the start and end of a pair
+        write_mixed(self.path, 200)
+        sequential = self.read(1)
+        for jobs in (2, 3, 7):
+            self.assertEqual(self.read(jobs), sequential)
+
+    def test_more_jobs_than_lines(self):
+        write_mixed(self.path, 1)
+        self.assertEqual(self.read(10), self.read(1))
+
+class FilterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "stats.txt")
+        write_mixed(self.path, 60)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_filtered_like_cached(self):
+        # the same samples, whether the dump is cached or not
+        sc.read_stats(self.path, None, 10, 50)
+        filtered = snapshot()
+        self.assertFalse(os.path.exists(sc.cache_filename(self.path)))
+        sc.read_stats(self.path)
+        self.assertTrue(os.path.exists(sc.cache_filename(self.path)))
+        sc.read_stats(self.path, None, 10, 50)
+        self.assertEqual(filtered, snapshot())
+
+        # samples are selected by their own timestamps
+        self.assertEqual(filtered["delay"][1], list(range(13, 54)))
+        self.assertEqual(filtered["vsync"][0], list(range(10, 51)))
+        self.assertEqual(filtered["volume"][1], list(range(10, 51)))
+        self.assertEqual(len(filtered["render"][0]), 2 * 40 + 1)
+
+    def test_filtered_by_name(self):
+        sc.read_stats(self.path, re.compile("delay"), 55, None)
+        self.assertEqual(snapshot(), {"delay": ([55.0, 56.0], [58.0, 59.0])})
+
+class TraceTest(unittest.TestCase):
+    def test_export(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as f:
+            f.write("1000000 start render #vo\n"
+                    "1001000 start render #vo\n" # nested
+                    "1002000 end render #vo\n"
+                    "1005000 end render #vo\n"
+                    "1006000 end render #vo\n" # unpaired
+                    "1003000 start render #ao\n"
+                    "1004000 end render #ao\n"
+                    "1007000 value 0.5 volume\n"
+                    "1008000 signal frame-drop\n"
+                    "1009000 start ignored #vo\n"
+                    "1010000 end ignored #vo\n")
+            f.flush()
+            out = io.StringIO()
+            sc.export_trace(f.name, out, re.compile("render|volume|frame"))
+        trace = json.loads(out.getvalue())
+        threads = {ev["args"]["name"]: ev["tid"] for ev in trace["traceEvents"]
+                   if ev["name"] == "thread_name"}
+        self.assertEqual(set(threads), {"vo", "ao", "mpv"})
+        events = [ev for ev in trace["traceEvents"] if ev["ph"] != "M"]
+        self.assertEqual(
+            sorted((ev["tid"], ev["ph"], ev["name"], ev["ts"], ev.get("dur"))
+                   for ev in events),
+            sorted([(threads["vo"], "X", "render", 1000, 1000),
+                    (threads["vo"], "X", "render", 0, 5000),
+                    (threads["ao"], "X", "render", 3000, 1000),
+                    (threads["mpv"], "C", "volume", 7000, None),
+                    (threads["mpv"], "i", "frame-drop", 8000, None)]))
+        counter = [ev for ev in events if ev["ph"] == "C"][0]
+        self.assertEqual(counter["args"], {"volume": 0.5})
+
+class FollowTest(unittest.TestCase):
+    def test_trim_unsorted(self):
+        sc.G.events = {}
+        sc.G.start = None
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as f:
+            # value-timed samples carry their own timestamps, out of order
+            f.write("1000000 value-timed 9000000 1 delay\n"
+                    "2000000 value-timed 1000000 2 delay\n"
+                    "3000000 value-timed 8000000 3 delay\n"
+                    "10000000 value 4 volume\n")
+            f.flush()
+            follower = sc.Follower(f.name, 5)
+            self.assertTrue(follower.poll())
+            follower.f.close()
+        # the cutoff is 9 - 5 = 4 s after the first sample
+        delay = sc.G.events["delay"]
+        self.assertEqual(list(delay.ts), [8.0, 7.0])
+        self.assertEqual(list(delay.vals), [1.0, 3.0])
+        self.assertEqual(list(sc.G.events["volume"].vals), [4.0])
+
+class ViewTest(unittest.TestCase):
+    def check_windows(self, ts, data, width, step):
+        x, (p50, p99) = sc.windowed_percentiles(ts, data, width, [50, 99],
+                                                 step)
+        expected = []
+        for k in range(int(sc.np.floor(ts.min() / step)) - 10,
+                       int(ts.max() / step) + 1):
+            inside = sorted(data[(ts >= k * step) & (ts < k * step + width)])
+            if inside:
+                n = len(inside)
+                expected.append((k * step, inside[int(0.5 * (n - 1) + 0.5)],
+                                 inside[int(0.99 * (n - 1) + 0.5)]))
+        self.assertEqual(len(x), len(expected))
+        for got, exp in zip(zip(x, p50, p99), expected):
+            self.assertAlmostEqual(got[0], exp[0])
+            self.assertEqual(got[1:], exp[1:])
+
+    def test_windowed_percentiles(self):
+        rnd = random.Random(4)
+        ts = sc.np.array(sorted(rnd.uniform(-2, 30) for n in range(500)))
+        data = sc.np.array([float(rnd.randint(0, 1000)) for n in ts])
+        self.check_windows(ts, data, 2, 2)
+        self.check_windows(ts, data, 5, 1)
+        self.check_windows(ts, data, 2.5, 1)
+        self.check_windows(ts, data, 1, 0.25)
+
+    def test_heatmap_negative(self):
+        ts = sc.np.linspace(0, 10, 1000)
+        data = sc.np.sin(ts) * 50
+        hist, (x, y, w, h) = sc.heatmap(ts, data, 1, 20)
+        self.assertEqual(hist.sum(), len(data))
+        self.assertLess(y, -45)
+        self.assertGreater(y + h, 45)
+
+if __name__ == "__main__":
+    unittest.main()
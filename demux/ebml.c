@@ -321,19 +321,34 @@ static double ebml_parse_float(uint8_t *data, int length)
 }
 
 
-// target must be initialized to zero
-static void ebml_parse_element(struct ebml_parse_ctx *ctx, void *target,
-                               uint8_t *data, int size,
-                               const struct ebml_elem_desc *type, int level)
+// Return the index of the field with the given ID, or -1. The generated
+// field lists are sorted by ID (see TOOLS/matroska.py).
+static int ebml_find_field(const struct ebml_elem_desc *type, uint32_t id)
 {
-    assert(type->type == EBML_TYPE_SUBELEMENTS);
-    assert(level < 8);
-    MP_TRACE(ctx, "%.*sParsing element %s\n", level, "       ", type->name);
+    int lo = 0, hi = type->field_count;
+    while (lo < hi) {
+        int mid = lo + (hi - lo) / 2;
+        uint32_t mid_id = type->fields[mid].id;
+        if (mid_id == id)
+            return mid;
+        if (mid_id < id)
+            lo = mid + 1;
+        else
+            hi = mid;
+    }
+    return -1;
+}
 
-    char *s = target;
+// First pass over the subelements of an element: count how many there are
+// of each field, so that arrays can be allocated up front. Returns the end of
+// the part of the data that can be parsed.
+static uint8_t *ebml_count_subelements(struct ebml_parse_ctx *ctx,
+                                       uint8_t *data, int size,
+                                       const struct ebml_elem_desc *type,
+                                       int *num_elems)
+{
     uint8_t *end = data + size;
     uint8_t *p = data;
-    int num_elems[MAX_EBML_SUBELEMENTS] = {0};
     while (p < end) {
         uint8_t *startp = p;
         int len;
@@ -354,17 +369,14 @@ static void ebml_parse_element(struct ebml_parse_ctx *ctx, void *target,
         }
         p += len;
 
-        int field_idx = -1;
-        for (int i = 0; i < type->field_count; i++)
-            if (type->fields[i].id == id) {
-                field_idx = i;
-                num_elems[i]++;
-                if (num_elems[i] >= 0x70000000) {
-                    MP_ERR(ctx, "Too many EBML subelements.\n");
-                    goto other_error;
-                }
-                break;
+        int field_idx = ebml_find_field(type, id);
+        if (field_idx >= 0) {
+            num_elems[field_idx]++;
+            if (num_elems[field_idx] >= 0x70000000) {
+                MP_ERR(ctx, "Too many EBML subelements.\n");
+                goto other_error;
             }
+        }
 
         if (length > end - p) {
             if (field_idx >= 0 && type->fields[field_idx].desc->type
@@ -388,6 +400,97 @@ static void ebml_parse_element(struct ebml_parse_ctx *ctx, void *target,
         end = startp;
         break;
     }
+    return end;
+}
+
+// Parse the ID and length of the next subelement, and advance *data to its
+// contents. length is clamped to the end of the containing element.
+static bool ebml_next_subelement(struct ebml_parse_ctx *ctx, uint8_t **data,
+                                 uint8_t *end, uint32_t *id, uint64_t *length)
+{
+    int len;
+    *id = ebml_parse_id(*data, end - *data, &len);
+    if (len < 0 || len > end - *data) {
+        MP_ERR(ctx, "Error parsing subelement\n");
+        return false;
+    }
+    *data += len;
+    *length = ebml_parse_length(*data, end - *data, &len);
+    if (len < 0 || len > end - *data) {
+        MP_ERR(ctx, "Error parsing subelement length\n");
+        return false;
+    }
+    *data += len;
+    if (*length > end - *data) {
+        // Try to parse what is possible from inside this partial element
+        *length = end - *data;
+        MP_ERR(ctx, "Next subelement content goes "
+               "past end of containing element, will be truncated\n");
+    }
+    return true;
+}
+
+static void ebml_skip_unknown(struct ebml_parse_ctx *ctx, uint32_t id,
+                              uint64_t length, int level)
+{
+    if (id == 0xec) {
+        MP_TRACE(ctx, "%.*sIgnoring Void element "
+                 "size: %"PRIu64"\n", level+1, "        ", length);
+    } else if (id == 0xbf) {
+        MP_TRACE(ctx, "%.*sIgnoring CRC-32 "
+                 "element size: %"PRIu64"\n", level+1, "        ",
+                 length);
+    } else {
+        MP_DBG(ctx, "Ignoring unrecognized "
+               "subelement. ID: %x size: %"PRIu64"\n", id, length);
+    }
+}
+
+// Whether another subelement can be stored in a field that already has count
+// entries, out of num_elems found by ebml_count_subelements().
+static bool ebml_check_count(struct ebml_parse_ctx *ctx, int count,
+                             int num_elems, bool multiple, uint32_t id,
+                             const char *name, uint64_t length)
+{
+    if (count >= num_elems) {
+        // Shouldn't happen on any sane file without bugs
+        MP_ERR(ctx, "Too many subelements.\n");
+        ctx->has_errors = true;
+        return false;
+    }
+    if (count > 0 && !multiple) {
+        MP_WARN(ctx, "Another subelement of type "
+                "%x %s (size: %"PRIu64"). Only one allowed. Ignoring.\n",
+                id, name, length);
+        ctx->has_errors = true;
+        return false;
+    }
+    return true;
+}
+
+static void ebml_parse_element(struct ebml_parse_ctx *ctx, void *target,
+                               uint8_t *data, int size,
+                               const struct ebml_elem_desc *type, int level);
+
+// Defines ebml_parse_generated(), which dispatches to the parsers generated
+// for frequently used elements.
+#include "generated/ebml_parsers.inc"
+
+// target must be initialized to zero
+static void ebml_parse_element(struct ebml_parse_ctx *ctx, void *target,
+                               uint8_t *data, int size,
+                               const struct ebml_elem_desc *type, int level)
+{
+    assert(type->type == EBML_TYPE_SUBELEMENTS);
+    assert(level < 8);
+    if (!ctx->no_generated_parsers &&
+        ebml_parse_generated(ctx, target, data, size, type, level))
+        return;
+    MP_TRACE(ctx, "%.*sParsing element %s\n", level, "       ", type->name);
+
+    char *s = target;
+    int num_elems[MAX_EBML_SUBELEMENTS] = {0};
+    uint8_t *end = ebml_count_subelements(ctx, data, size, type, num_elems);
 
     for (int i = 0; i < type->field_count; i++) {
         if (num_elems[i] && type->fields[i].multiple) {
@@ -435,43 +538,13 @@ static void ebml_parse_element(struct ebml_parse_ctx *ctx, void *target,
     }
 
     while (data < end) {
-        int len;
-        uint32_t id = ebml_parse_id(data, end - data, &len);
-        if (len < 0 || len > end - data) {
-            MP_ERR(ctx, "Error parsing subelement\n");
+        uint32_t id;
+        uint64_t length;
+        if (!ebml_next_subelement(ctx, &data, end, &id, &length))
             break;
-        }
-        data += len;
-        uint64_t length = ebml_parse_length(data, end - data, &len);
-        if (len < 0 || len > end - data) {
-            MP_ERR(ctx, "Error parsing subelement length\n");
-            break;
-        }
-        data += len;
-        if (length > end - data) {
-            // Try to parse what is possible from inside this partial element
-            length = end - data;
-            MP_ERR(ctx, "Next subelement content goes "
-                   "past end of containing element, will be truncated\n");
-        }
-        int field_idx = -1;
-        for (int i = 0; i < type->field_count; i++)
-            if (type->fields[i].id == id) {
-                field_idx = i;
-                break;
-            }
+        int field_idx = ebml_find_field(type, id);
         if (field_idx < 0) {
-            if (id == 0xec) {
-                MP_TRACE(ctx, "%.*sIgnoring Void element "
-                         "size: %"PRIu64"\n", level+1, "        ", length);
-            } else if (id == 0xbf) {
-                MP_TRACE(ctx, "%.*sIgnoring CRC-32 "
-                         "element size: %"PRIu64"\n", level+1, "        ",
-                         length);
-            } else {
-                MP_DBG(ctx, "Ignoring unrecognized "
-                       "subelement. ID: %x size: %"PRIu64"\n", id, length);
-            }
+            ebml_skip_unknown(ctx, id, length, level);
             data += length;
             continue;
         }
@@ -479,18 +552,8 @@ static void ebml_parse_element(struct ebml_parse_ctx *ctx, void *target,
         const struct ebml_elem_desc *ed = fd->desc;
         bool multiple = fd->multiple;
         int *countptr = (int *) (s + fd->count_offset);
-        if (*countptr >= num_elems[field_idx]) {
-            // Shouldn't happen on any sane file without bugs
-            MP_ERR(ctx, "Too many subelements.\n");
-            ctx->has_errors = true;
-            data += length;
-            continue;
-        }
-        if (*countptr > 0 && !multiple) {
-            MP_WARN(ctx, "Another subelement of type "
-                    "%x %s (size: %"PRIu64"). Only one allowed. Ignoring.\n",
-                    id, ed->name, length);
-            ctx->has_errors = true;
+        if (!ebml_check_count(ctx, *countptr, num_elems[field_idx], multiple,
+                              id, ed->name, length)) {
             data += length;
             continue;
         }
@@ -573,9 +636,10 @@ static void ebml_parse_element(struct ebml_parse_ctx *ctx, void *target,
 
         case EBML_TYPE_EBML_ID:;
             uint32_t *idptr;
+            int id_len;
             GETPTR(idptr, uint32_t);
-            *idptr = ebml_parse_id(data, end - data, &len);
-            if (len != length) {
+            *idptr = ebml_parse_id(data, end - data, &id_len);
+            if (id_len != length) {
                 MP_ERR(ctx, "ebml_id broken value\n");
                 goto error;
             }
@@ -61,6 +61,9 @@ struct ebml_parse_ctx {
     void *talloc_ctx;
     bool has_errors;
     bool no_error_messages;
+    // Parse all elements with the descriptor tables, instead of using the
+    // specialized parsers from ebml_parsers.inc (for testing).
+    bool no_generated_parsers;
 };
 
 #include "generated/ebml_types.h"
@@ -0,0 +1,159 @@
+#include "common/common.h"
+#include "common/msg.h"
+#include "demux/ebml.h"
+#include "stream/stream.h"
+#include "tests.h"
+
+// Element size followed by the contents of a Cues element with 3 CuePoints.
+// Besides normal entries, this has Void and unknown elements, duplicates of
+// single elements, a uint of length 0, and a CueTrackPositions that goes past
+// the end of the data.
+static const uint8_t cues_data[] = {
+    0xc4, 0xbb, 0xa0, 0xb3, 0x81, 0x0a, 0xb7, 0x8a, 0xf7, 0x81, 0x01, 0xf1,
+    0x82, 0x01, 0x00, 0xf0, 0x81, 0x05, 0xb7, 0x89, 0xf7, 0x81, 0x02, 0xf1,
+    0x81, 0x20, 0xb2, 0x81, 0x03, 0xec, 0x81, 0x00, 0xc0, 0x81, 0x00, 0xbb,
+    0x96, 0xb3, 0x82, 0x01, 0x00, 0xb3, 0x81, 0x07, 0xb7, 0x8d, 0xf7, 0x81,
+    0x01, 0xf1, 0x83, 0x01, 0x00, 0x00, 0xf1, 0x81, 0x09, 0xb2, 0x80, 0xbb,
+    0x88, 0xb3, 0x81, 0x14, 0xb7, 0x88, 0xf7, 0x81, 0x04,
+};
+
+// Same for a Tags element with 2 Tags, including a duplicate TagString and
+// Targets, and a TagDefault of length 0.
+static const uint8_t tags_data[] = {
+    0xee, 0x73, 0x73, 0xbf, 0x63, 0xc0, 0x84, 0x68, 0xca, 0x81, 0x32, 0x67,
+    0xc8, 0x8f, 0x45, 0xa3, 0x85, 0x54, 0x49, 0x54, 0x4c, 0x45, 0x44, 0x87,
+    0x84, 0x54, 0x65, 0x73, 0x74, 0x67, 0xc8, 0x9f, 0x45, 0xa3, 0x86, 0x41,
+    0x52, 0x54, 0x49, 0x53, 0x54, 0x44, 0x7a, 0x83, 0x65, 0x6e, 0x67, 0x44,
+    0x84, 0x81, 0x01, 0x44, 0x87, 0x83, 0x61, 0x62, 0x63, 0x44, 0x87, 0x83,
+    0x64, 0x65, 0x66, 0xec, 0x82, 0x00, 0x00, 0x73, 0x73, 0xa9, 0x67, 0xc8,
+    0x90, 0x45, 0xa3, 0x87, 0x43, 0x4f, 0x4d, 0x4d, 0x45, 0x4e, 0x54, 0x44,
+    0x84, 0x80, 0xc0, 0x81, 0x78, 0x63, 0xc0, 0x8c, 0x68, 0xca, 0x81, 0x1e,
+    0x63, 0xca, 0x85, 0x41, 0x4c, 0x42, 0x55, 0x4d, 0x63, 0xc0, 0x84, 0x68,
+    0xca, 0x81, 0x28,
+};
+
+// Parse data with ebml_read_element(). Returns the talloc context owning the
+// parsed data.
+static void *parse(struct test_ctx *ctx, const uint8_t *data, int len,
+                   const struct ebml_elem_desc *desc, void *target,
+                   bool generated, bool *has_errors)
+{
+    struct stream *s = stream_memory_open(ctx->global, (void *)data, len);
+    assert_true(s);
+    struct ebml_parse_ctx parse_ctx = {
+        .log = mp_null_log,
+        .no_error_messages = true,
+        .no_generated_parsers = !generated,
+    };
+    assert_int_equal(ebml_read_element(s, &parse_ctx, target, desc), 0);
+    free_stream(s);
+    *has_errors = parse_ctx.has_errors;
+    return parse_ctx.talloc_ctx;
+}
+
+static void assert_str_equal(const char *a, const char *b)
+{
+    assert_true(!a == !b);
+    if (a)
+        assert_string_equal(a, b);
+}
+
+static void test_cues(struct test_ctx *ctx)
+{
+    struct ebml_cues a = {0}, b = {0};
+    bool a_err, b_err;
+    void *ta = parse(ctx, cues_data, sizeof(cues_data), &ebml_cues_desc, &a,
+                     true, &a_err);
+    void *tb = parse(ctx, cues_data, sizeof(cues_data), &ebml_cues_desc, &b,
+                     false, &b_err);
+    assert_true(a_err && b_err);
+
+    assert_int_equal(a.n_cue_point, 3);
+    assert_int_equal(a.cue_point[0].cue_time, 10);
+    assert_int_equal(a.cue_point[0].n_cue_track_positions, 2);
+    assert_int_equal(a.cue_point[0].cue_track_positions[0].cue_cluster_position,
+                     256);
+    assert_int_equal(a.cue_point[1].cue_time, 256);
+
+    assert_int_equal(a.n_cue_point, b.n_cue_point);
+    for (int n = 0; n < a.n_cue_point; n++) {
+        struct ebml_cue_point *pa = &a.cue_point[n], *pb = &b.cue_point[n];
+        assert_int_equal(pa->n_cue_time, pb->n_cue_time);
+        assert_int_equal(pa->cue_time, pb->cue_time);
+        assert_int_equal(pa->n_cue_track_positions, pb->n_cue_track_positions);
+        for (int i = 0; i < pa->n_cue_track_positions; i++) {
+            struct ebml_cue_track_positions *ca = &pa->cue_track_positions[i];
+            struct ebml_cue_track_positions *cb = &pb->cue_track_positions[i];
+            assert_int_equal(ca->n_cue_track, cb->n_cue_track);
+            assert_int_equal(ca->cue_track, cb->cue_track);
+            assert_int_equal(ca->n_cue_cluster_position,
+                             cb->n_cue_cluster_position);
+            assert_int_equal(ca->cue_cluster_position, cb->cue_cluster_position);
+            assert_int_equal(ca->n_cue_relative_position,
+                             cb->n_cue_relative_position);
+            assert_int_equal(ca->cue_relative_position,
+                             cb->cue_relative_position);
+            assert_int_equal(ca->n_cue_duration, cb->n_cue_duration);
+            assert_int_equal(ca->cue_duration, cb->cue_duration);
+        }
+    }
+
+    talloc_free(ta);
+    talloc_free(tb);
+}
+
+static void test_tags(struct test_ctx *ctx)
+{
+    struct ebml_tags a = {0}, b = {0};
+    bool a_err, b_err;
+    void *ta = parse(ctx, tags_data, sizeof(tags_data), &ebml_tags_desc, &a,
+                     true, &a_err);
+    void *tb = parse(ctx, tags_data, sizeof(tags_data), &ebml_tags_desc, &b,
+                     false, &b_err);
+    assert_true(a_err && b_err);
+
+    assert_int_equal(a.n_tag, 2);
+    assert_int_equal(a.tag[0].n_simple_tag, 2);
+    assert_string_equal(a.tag[0].simple_tag[1].tag_string, "abc");
+    assert_int_equal(a.tag[1].targets.target_type_value, 30);
+
+    assert_int_equal(a.n_tag, b.n_tag);
+    for (int n = 0; n < a.n_tag; n++) {
+        struct ebml_tag *ga = &a.tag[n], *gb = &b.tag[n];
+        assert_int_equal(ga->n_targets, gb->n_targets);
+        assert_int_equal(ga->targets.n_target_type_value,
+                         gb->targets.n_target_type_value);
+        assert_int_equal(ga->targets.target_type_value,
+                         gb->targets.target_type_value);
+        assert_str_equal(ga->targets.target_type, gb->targets.target_type);
+        assert_int_equal(ga->n_simple_tag, gb->n_simple_tag);
+        for (int i = 0; i < ga->n_simple_tag; i++) {
+            struct ebml_simple_tag *sa = &ga->simple_tag[i];
+            struct ebml_simple_tag *sb = &gb->simple_tag[i];
+            assert_int_equal(sa->n_tag_name, sb->n_tag_name);
+            assert_str_equal(sa->tag_name, sb->tag_name);
+            assert_int_equal(sa->n_tag_language, sb->n_tag_language);
+            assert_str_equal(sa->tag_language, sb->tag_language);
+            assert_int_equal(sa->n_tag_string, sb->n_tag_string);
+            assert_str_equal(sa->tag_string, sb->tag_string);
+            assert_int_equal(sa->n_tag_default, sb->n_tag_default);
+            assert_int_equal(sa->tag_default, sb->tag_default);
+        }
+    }
+
+    talloc_free(ta);
+    talloc_free(tb);
+}
+
+// Check that the generated parsers (generated/ebml_parsers.inc) give the
+// same results as parsing with the descriptor tables.
+static void run(struct test_ctx *ctx)
+{
+    test_cues(ctx);
+    test_tags(ctx);
+}
+
+const struct unittest test_ebml = {
+    .name = "ebml",
+    .run = run,
+};
@@ -5,6 +5,7 @@
 
 static const struct unittest *unittests[] = {
     &test_chmap,
+    &test_ebml,
     &test_gl_video,
     &test_img_format,
     &test_json,
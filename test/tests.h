@@ -37,6 +37,7 @@ struct unittest {
 };
 
 extern const struct unittest test_chmap;
+extern const struct unittest test_ebml;
 extern const struct unittest test_gl_video;
 extern const struct unittest test_img_format;
 extern const struct unittest test_json;
@@ -1,8 +1,8 @@
 from waflib.Build import BuildContext
 from waflib import TaskGen, Utils
 from io import StringIO
-from TOOLS.matroska import generate_C_header, generate_C_definitions
 from TOOLS.file2string import file2string
+import hashlib
 import os
 
 def __wayland_scanner_cmd__(ctx, mode, dir, src, vendored_file):
@@ -19,15 +19,36 @@ def __file2string__(ctx, **kwargs):
         **kwargs
     )
 
-def execf(self, fn):
+def __deps_signature__(deps):
+    h = hashlib.sha1()
+    for dep in deps:
+        with open(dep, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def execf(self, fn, deps=()):
     setattr(self, 'before', ['c'])
     setattr(self, 'rule', ' ') # waf doesn't print the task with no rule
     target = getattr(self, 'target', None)
     out = self.path.find_or_declare(target)
+    # If the files the generator depends on are unchanged since the last run,
+    # skip running it at all.
+    sig_file = out.abspath() + '.sig'
+    sig = __deps_signature__(deps) if deps else None
+    if sig and out.exists() and os.path.exists(sig_file):
+        with open(sig_file) as f:
+            if f.read() == sig:
+                return
     tmp = StringIO()
     fn(tmp)
-    out.write(tmp.getvalue())
+    # Don't touch the output if its contents are the same, so that the files
+    # including it are not recompiled.
+    if not out.exists() or out.read() != tmp.getvalue():
+        out.write(tmp.getvalue())
     tmp.close()
+    if sig:
+        with open(sig_file, 'w') as f:
+            f.write(sig)
 
 @TaskGen.feature('file2string')
 def f2s(self):
@@ -37,13 +58,25 @@ def f2s(self):
         file2string(source, iter(src.read('rb').splitlines(True)), out)
     execf(self, fn)
 
+def __matroska_generator__(self, name):
+    def fn(out):
+        # Imported only when the cached output is out of date.
+        from TOOLS import matroska
+        getattr(matroska, name)(out)
+    source = self.bld.srcnode.find_resource('TOOLS/matroska.py')
+    execf(self, fn, deps=[source.abspath()])
+
 @TaskGen.feature('ebml_header')
 def ebml_header(self):
-    execf(self, generate_C_header)
+    __matroska_generator__(self, 'generate_C_header')
 
 @TaskGen.feature('ebml_definitions')
 def ebml_definitions(self):
-    execf(self, generate_C_definitions)
+    __matroska_generator__(self, 'generate_C_definitions')
+
+@TaskGen.feature('ebml_parsers')
+def ebml_parsers(self):
+    __matroska_generator__(self, 'generate_C_parsers')
 
 def __wayland_protocol_code__(ctx, **kwargs):
     protocol_is_vendored = kwargs.get("vendored_protocol", False)
@@ -156,6 +156,7 @@ def build(ctx):
 
     ctx(features = "ebml_header", target = "generated/ebml_types.h")
     ctx(features = "ebml_definitions", target = "generated/ebml_defs.inc")
+    ctx(features = "ebml_parsers", target = "generated/ebml_parsers.inc")
 
     def swift(task):
         src = [x.abspath() for x in task.inputs]
@@ -417,6 +418,7 @@ def build(ctx):
 
         ## Tests
         ( "test/chmap.c",                        "tests" ),
+        ( "test/ebml.c",                         "tests" ),
         ( "test/gl_video.c",                     "tests" ),
         ( "test/img_format.c",                   "tests" ),
         ( "test/json.c",                         "tests" ),